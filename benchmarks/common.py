@@ -0,0 +1,35 @@
+"""Shared helpers for the benchmark scripts"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+
+def setup_django(database, migrate=True, **extra):
+    """Configure a standalone Django project using a SQLite database. Extra
+    keyword arguments are added to the settings."""
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "notifpy",
+        ],
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": database,
+                "OPTIONS": {"timeout": 30},
+            },
+        },
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+        **extra
+    )
+    django.setup()
+    if migrate:
+        from django.core.management import call_command
+        call_command("migrate", verbosity=0)
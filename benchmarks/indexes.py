@@ -0,0 +1,143 @@
+"""Benchmark the hot queries before and after the index migration.
+
+Usage:
+
+    python benchmarks/indexes.py --videos 1000000
+
+A synthetic database is built at the schema preceding the index migration,
+the query plans and timings of the hot queries are reported, then the
+migration is applied and the same queries are measured again.
+"""
+
+import os
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+from common import setup_django
+
+
+BEFORE = "0014_feedentry_cursor_indexes"
+AFTER = "0015_query_indexes"
+
+
+def get_models(migration):
+    """Return the historical models at a migration, so that fields added
+    later do not break the benchmark"""
+    from django.db import connection
+    from django.db.migrations.executor import MigrationExecutor
+    return MigrationExecutor(connection).loader.project_state(("notifpy", migration)).apps
+
+
+def populate(n_videos, n_channels, n_users):
+    from django.db import connection
+    apps = get_models(BEFORE)
+    User = apps.get_model("auth", "User")
+    YoutubeChannel = apps.get_model("notifpy", "YoutubeChannel")
+    YoutubeSubscription = apps.get_model("notifpy", "YoutubeSubscription")
+    Filter = apps.get_model("notifpy", "Filter")
+    User.objects.bulk_create([User(username="user%d" % i) for i in range(n_users)])
+    user_ids = list(User.objects.values_list("id", flat=True))
+    channel_ids = ["UC%022d" % i for i in range(n_channels)]
+    YoutubeChannel.objects.bulk_create([
+        YoutubeChannel(
+            id=channel_id,
+            title=channel_id,
+            slug=channel_id.lower(),
+            thumbnail="http://localhost/c.jpg",
+            playlist_id="UU" + channel_id[2:],
+        )
+        for channel_id in channel_ids
+    ])
+    YoutubeSubscription.objects.bulk_create([
+        YoutubeSubscription(user_id=user_id, channel_id=channel_id)
+        for user_id in user_ids
+        for channel_id in random.sample(channel_ids, n_channels // 2)
+    ])
+    Filter.objects.bulk_create([
+        Filter(user_id=user_id, channel_id=channel_id, regex="^a")
+        for user_id in user_ids
+        for channel_id in random.sample(channel_ids, n_channels // 10)
+    ])
+    start = datetime.datetime(2015, 1, 1)
+    span = 6 * 365 * 24 * 3600
+    batch_size = 50000
+    with connection.cursor() as cursor:
+        for offset in range(0, n_videos, batch_size):
+            rows = list()
+            for i in range(offset, min(n_videos, offset + batch_size)):
+                date = start + datetime.timedelta(seconds=random.randrange(span))
+                rows.append((
+                    "%011d" % i,
+                    random.choice(channel_ids),
+                    "Video %d" % i,
+                    date.strftime("%Y-%m-%d %H:%M:%S"),
+                    date.strftime("%Y-%m-%d %H:%M:%S"),
+                    "http://localhost/t.jpg",
+                ))
+            cursor.executemany(
+                "INSERT INTO notifpy_youtubevideo "
+                "(id, channel_id, title, publication, gathering, thumbnail) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows
+            )
+    return user_ids, channel_ids
+
+
+def get_queries(migration, user_ids, channel_ids):
+    from django.utils import timezone
+    apps = get_models(migration)
+    YoutubeVideo = apps.get_model("notifpy", "YoutubeVideo")
+    YoutubeSubscription = apps.get_model("notifpy", "YoutubeSubscription")
+    Filter = apps.get_model("notifpy", "Filter")
+    cutoff = timezone.make_aware(datetime.datetime(2015, 2, 1))
+    return [
+        ("channel videos", lambda: YoutubeVideo.objects
+         .filter(channel_id=random.choice(channel_ids))
+         .order_by("-publication")[:15]),
+        ("old videos", lambda: YoutubeVideo.objects
+         .filter(gathering__lt=cutoff)
+         .values_list("id", flat=True)[:1000]),
+        ("user filters", lambda: Filter.objects
+         .filter(user_id=random.choice(user_ids), channel_id=random.choice(channel_ids))),
+        ("subscription", lambda: YoutubeSubscription.objects
+         .filter(user_id=random.choice(user_ids), channel_id=random.choice(channel_ids))),
+    ]
+
+
+def measure(label, queries, repeat):
+    print("\n== %s ==" % label)
+    for name, make in queries:
+        print("\n%s\n  %s" % (name, make().explain().replace("\n", "\n  ")))
+        start = time.time()
+        for _ in range(repeat):
+            list(make())
+        print("  %.3f ms/query" % (1000 * (time.time() - start) / repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-v", "--videos", type=int, default=1000000)
+    parser.add_argument("-c", "--channels", type=int, default=2000)
+    parser.add_argument("-u", "--users", type=int, default=20)
+    parser.add_argument("-r", "--repeat", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as folder:
+        setup_django(os.path.join(folder, "bench.sqlite3"), migrate=False)
+        from django.core.management import call_command
+        call_command("migrate", verbosity=0)
+        call_command("migrate", "notifpy", BEFORE, verbosity=0)
+        print("Populating %d videos" % args.videos)
+        user_ids, channel_ids = populate(args.videos, args.channels, args.users)
+        measure("Before %s" % AFTER, get_queries(BEFORE, user_ids, channel_ids), args.repeat)
+        start = time.time()
+        call_command("migrate", "notifpy", AFTER, verbosity=0)
+        print("\nMigration took %.1f s" % (time.time() - start))
+        measure("After %s" % AFTER, get_queries(AFTER, user_ids, channel_ids), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
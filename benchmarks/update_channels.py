@@ -0,0 +1,205 @@
+"""Benchmark channel updates against a local fake YouTube server.
+
+Usage:
+
+    python benchmarks/update_channels.py --channels 500 --workers 1 8 16
+    python benchmarks/update_channels.py --source rss
+
+The fake server answers playlistItems and RSS feed requests after a fixed
+latency, which simulates the round-trip to YouTube. Throughput is reported
+in channels per second for each worker count, along with the number of API
+requests sent.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import http.server
+import urllib.parse
+
+from common import setup_django
+
+
+FEED_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+<title>%(channel_id)s</title>
+%(entries)s
+</feed>"""
+
+ENTRY_TEMPLATE = """<entry>
+<yt:videoId>%(video_id)s</yt:videoId>
+<yt:channelId>%(channel_id)s</yt:channelId>
+<title>%(title)s</title>
+<published>2021-01-01T00:00:00+00:00</published>
+</entry>"""
+
+
+class FakeYoutubeHandler(http.server.BaseHTTPRequestHandler):
+
+    """Serve fake playlistItems pages and RSS feeds"""
+
+    latency = .1
+    items_per_page = 5
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        time.sleep(self.latency)
+        if url.path.endswith("/feeds/videos.xml"):
+            self.send_feed(params["channel_id"][0])
+            return
+        playlist_id = params["playlistId"][0]
+        if self.headers.get("If-None-Match") == "etag-%s" % playlist_id:
+            self.send_response(304)
+            self.end_headers()
+            return
+        items = list()
+        for i in range(self.items_per_page):
+            items.append({
+                "snippet": {
+                    "title": "Video %d of %s" % (i, playlist_id),
+                    "publishedAt": "2021-01-01T00:00:00Z",
+                    "resourceId": {
+                        "kind": "youtube#video",
+                        "videoId": ("%s%d" % (playlist_id[-9:], i)).rjust(11, "0")[-11:],
+                    },
+                    "thumbnails": {
+                        "medium": {"url": "http://localhost/t.jpg", "width": 320, "height": 180},
+                    },
+                },
+            })
+        body = json.dumps({
+            "etag": "etag-%s" % playlist_id,
+            "items": items,
+        }).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_feed(self, channel_id):
+        etag = '"feed-%s"' % channel_id
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = (FEED_TEMPLATE % {
+            "channel_id": channel_id,
+            "entries": "\n".join(
+                ENTRY_TEMPLATE % {
+                    "video_id": ("%s%d" % (channel_id[-9:], i)).rjust(11, "0")[-11:],
+                    "channel_id": channel_id,
+                    "title": "Video %d of %s" % (i, channel_id),
+                }
+                for i in range(self.items_per_page)
+            ),
+        }).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def populate(n_channels):
+    from notifpy import models
+    models.Settings.objects.update_or_create(pk=1, defaults={
+        "youtube": json.dumps({
+            "client_id": "bench",
+            "client_secret": "bench",
+            "redirect_uri": "http://localhost/",
+            "scope": "bench",
+        })
+    })
+    models.Token.objects.update_or_create(pk=1, defaults={
+        "youtube": json.dumps({
+            "access_token": "bench",
+            "refresh_token": "bench",
+            "expires_in": 10 ** 9,
+            "delivery_time": time.time(),
+        })
+    })
+    models.YoutubeChannel.objects.bulk_create([
+        models.YoutubeChannel(
+            id="UC%022d" % i,
+            title="Channel %d" % i,
+            slug="channel-%d" % i,
+            priority=models.YoutubeChannel.PRIORITY_MEDIUM,
+            thumbnail="http://localhost/c.jpg",
+            playlist_id="UU%022d" % i,
+        )
+        for i in range(n_channels)
+    ])
+
+
+def run(n_channels, workers, source):
+    from notifpy import models
+    from notifpy.operator import Operator
+    models.YoutubeVideo.objects.all().delete()
+    models.YoutubeChannel.objects.update(
+        playlist_etag="", feed_etag="", feed_last_modified="", last_video_id="")
+    models.QuotaState.objects.update_or_create(name="youtube", defaults={
+        "content": 10 ** 9,
+        "last_update": time.time(),
+    })
+    operator = Operator()
+    operator.youtube.quota_bucket.size = 10 ** 9
+    devnull = open(os.devnull, "w")
+    stdout, sys.stdout = sys.stdout, devnull
+    start = time.time()
+    try:
+        operator.update_channels(
+            [models.YoutubeChannel.PRIORITY_MEDIUM],
+            workers=workers,
+            source=source
+        )
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    elapsed = time.time() - start
+    metrics = operator.youtube.metrics()
+    connections = sum(stats["connections"] for stats in metrics["hosts"].values())
+    print("workers=%3d  %6.2f s  %8.2f channels/s  %d videos  %d connections  %d API requests" % (
+        workers,
+        elapsed,
+        n_channels / elapsed,
+        models.YoutubeVideo.objects.count(),
+        connections,
+        metrics["requests"],
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-c", "--channels", type=int, default=200)
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("-l", "--latency", type=float, default=.1,
+                        help="Simulated API latency, in seconds.")
+    parser.add_argument("-s", "--source", choices=["api", "rss"], default="api")
+    args = parser.parse_args()
+    FakeYoutubeHandler.latency = args.latency
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeYoutubeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as folder:
+        setup_django(os.path.join(folder, "bench.sqlite3"))
+        from notifpy import atom
+        from notifpy.endpoint import YoutubeEndpoint
+        YoutubeEndpoint.base_url = "http://127.0.0.1:%d" % server.server_address[1]
+        atom.FEED_URL = YoutubeEndpoint.base_url + "/feeds/videos.xml"
+        populate(args.channels)
+        for workers in args.workers:
+            run(args.channels, workers, args.source)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Exercise the WebSub subscriber against a local stand-in hub.
+
+Usage:
+
+    python benchmarks/websub_hub.py --notifications 100
+
+The application and a stand-in hub are both served locally. The hub checks
+the subscription intent by calling the callback view, then pushes signed
+Atom notifications, one video each. The delivery latency is reported, and
+notifications with a wrong signature are checked to be ignored.
+"""
+
+import os
+import hmac
+import time
+import queue
+import hashlib
+import secrets
+import argparse
+import tempfile
+import threading
+import http.server
+import urllib.parse
+import wsgiref.simple_server
+
+import requests
+
+from common import setup_django
+
+
+ATOM_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+  <link rel="hub" href="https://pubsubhubbub.appspot.com"/>
+  <title>YouTube video feed</title>
+  <updated>2021-01-01T00:00:00+00:00</updated>
+  <entry>
+    <id>yt:video:{video_id}</id>
+    <yt:videoId>{video_id}</yt:videoId>
+    <yt:channelId>{channel_id}</yt:channelId>
+    <title>Video {video_id}</title>
+    <link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>
+    <author><name>Channel</name></author>
+    <published>2021-01-01T00:00:00+00:00</published>
+    <updated>2021-01-01T00:00:00+00:00</updated>
+  </entry>
+</feed>
+"""
+
+
+class StandInHubHandler(http.server.BaseHTTPRequestHandler):
+
+    """Accept subscription requests and queue them for verification"""
+
+    requests = queue.Queue()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        form = {key: values[0] for key, values in urllib.parse.parse_qs(body.decode("utf8")).items()}
+        self.send_response(202)
+        self.end_headers()
+        self.requests.put(form)
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return "http://127.0.0.1:%d" % server.server_address[1]
+
+
+def verify(form):
+    """Call the callback like a hub checking the subscriber intent"""
+    challenge = secrets.token_hex(8)
+    response = requests.get(form["hub.callback"], params={
+        "hub.mode": form["hub.mode"],
+        "hub.topic": form["hub.topic"],
+        "hub.challenge": challenge,
+        "hub.lease_seconds": form["hub.lease_seconds"],
+    })
+    return response.status_code == 200 and response.text == challenge
+
+
+def notify(form, channel_id, video_id, secret):
+    """Push a signed notification for one video"""
+    body = ATOM_TEMPLATE.format(video_id=video_id, channel_id=channel_id).encode("utf8")
+    signature = hmac.new(secret.encode("utf8"), body, hashlib.sha1).hexdigest()
+    return requests.post(form["hub.callback"], data=body, headers={
+        "Content-Type": "application/atom+xml",
+        "X-Hub-Signature": "sha1=" + signature,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("-n", "--notifications", type=int, default=100)
+    args = parser.parse_args()
+    hub = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHubHandler)
+    hub_url = serve(hub)
+    with tempfile.TemporaryDirectory() as folder:
+        setup_django(
+            os.path.join(folder, "bench.sqlite3"),
+            ROOT_URLCONF=__name__,
+            ALLOWED_HOSTS=["127.0.0.1"],
+            NOTIFPY_WEBSUB_HUB=hub_url + "/subscribe",
+            NOTIFPY_WEBSUB_CALLBACK_BASE="http://127.0.0.1:%d",
+        )
+        from django.conf import settings
+        from django.core.wsgi import get_wsgi_application
+        from django.urls import include, path
+        from notifpy import models, websub
+        globals()["urlpatterns"] = [path("notifpy/", include("notifpy.urls"))]
+        app = wsgiref.simple_server.make_server(
+            "127.0.0.1", 0, get_wsgi_application(), handler_class=QuietHandler)
+        settings.NOTIFPY_WEBSUB_CALLBACK_BASE = serve(app)
+        channel = models.YoutubeChannel.objects.create(
+            id="UC%022d" % 0,
+            title="Channel",
+            priority=models.YoutubeChannel.PRIORITY_MEDIUM,
+            thumbnail="http://localhost/c.jpg",
+            playlist_id="UU%022d" % 0,
+        )
+        print("Subscription accepted: %s" % websub.request_lease(channel))
+        form = StandInHubHandler.requests.get(timeout=10)
+        print("Intent verified: %s" % verify(form))
+        lease = models.WebSubLease.objects.get(channel=channel)
+        print("Lease expires on %s" % lease.expiration)
+        start = time.time()
+        for i in range(args.notifications):
+            notify(form, channel.id, "%011d" % i, form["hub.secret"])
+        elapsed = time.time() - start
+        print("%d notifications in %.2f s (%.1f ms each), %d videos stored" % (
+            args.notifications,
+            elapsed,
+            1000 * elapsed / max(1, args.notifications),
+            models.YoutubeVideo.objects.filter(channel=channel).count(),
+        ))
+        notify(form, channel.id, "forged00000", "wrong secret")
+        print("Forged notification ignored: %s" % (
+            not models.YoutubeVideo.objects.filter(id="forged00000").exists()))
+        app.shutdown()
+    hub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
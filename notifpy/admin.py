@@ -7,10 +7,11 @@ admin.site.register(models.Filter)
 admin.site.register(models.Playlist)
 admin.site.register(models.PlaylistMembership)
 admin.site.register(models.TwitchUser)
-admin.site.register(models.UpdateSchedule)
 admin.site.register(models.TwitchGame)
 admin.site.register(models.Settings)
 admin.site.register(models.Token)
+admin.site.register(models.QuotaState)
 admin.site.register(models.YoutubeSubscription)
 admin.site.register(models.TwitchSubscription)
-admin.site.register(models.SubscriptionHistory)
\ No newline at end of file
+admin.site.register(models.SubscriptionHistory)
+admin.site.register(models.WebSubLease)
\ No newline at end of file
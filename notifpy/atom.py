@@ -0,0 +1,38 @@
+"""This module parses the Atom documents published by YouTube: the uploads
+feed of a channel and the WebSub notifications share the same format"""
+
+import xml.etree.ElementTree as ET
+from xml.etree.ElementTree import ParseError
+
+
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
+NAMESPACES = {
+    "atom": ATOM_NAMESPACE,
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+ENTRY_TAG = "{%s}entry" % ATOM_NAMESPACE
+FEED_URL = "https://www.youtube.com/feeds/videos.xml"
+
+
+def thumbnail_url(video_id):
+    """Return the medium 16:9 thumbnail of a video, which is not part of
+    the Atom entries"""
+    return "https://i.ytimg.com/vi/%s/mqdefault.jpg" % video_id
+
+
+def iter_entries(source):
+    """Yield the video entries of an Atom document read from a file-like
+    object, as dictionnaries, newest first. Entries are released as soon as
+    they are parsed, so the document is never held in memory."""
+    for _, element in ET.iterparse(source, events=("end",)):
+        if element.tag != ENTRY_TAG:
+            continue
+        video_id = element.findtext("yt:videoId", namespaces=NAMESPACES)
+        if video_id:
+            yield {
+                "video_id": video_id,
+                "channel_id": element.findtext("yt:channelId", namespaces=NAMESPACES),
+                "title": element.findtext("atom:title", default="", namespaces=NAMESPACES),
+                "published": element.findtext("atom:published", namespaces=NAMESPACES),
+            }
+        element.clear()
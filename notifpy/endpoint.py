@@ -7,9 +7,28 @@ import time
 import random
 import logging
 import datetime
+import tempfile
+import threading
+import contextlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django import db
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least
 from . import models
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TOKENS = dict()
+TOKENS_LOCK = threading.Lock()
+
 
 def generate_random_state(length=24):
     """Return a random string of letters and figures of specified length"""
@@ -18,6 +37,53 @@ def generate_random_state(length=24):
     return "".join(random.choice(chars) for _ in range(length))
 
 
+def create_session(pool_size, retries, backoff):
+    """Return a HTTP session keeping connections alive, with exponential
+    backoff retries on rate limiting and server errors"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@contextlib.contextmanager
+def process_lock(name):
+    """Hold an exclusive lock shared by all the processes of the host, on
+    platforms supporting file locks"""
+    if fcntl is None:
+        yield
+        return
+    folder = getattr(settings, "NOTIFPY_LOCK_DIR", tempfile.gettempdir())
+    with open(os.path.join(folder, "notifpy-%s.lock" % name), "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def get_token(field):
+    """Return the token of an API, shared by the whole process. It is only
+    reloaded from the database when its version changed."""
+    with TOKENS_LOCK:
+        token = TOKENS.get(field)
+        if token is None:
+            token = TOKENS[field] = Token(field)
+        elif token.is_stale():
+            token.load()
+        return token
+
+
 class Credentials:
 
     """API credentials"""
@@ -42,6 +108,8 @@ class Token:
         self.refresh_token = None
         self.expires_in = None
         self.delivery_time = None
+        self.version = None
+        self.lock = threading.Lock()
         self.load()
 
     def has_expired(self):
@@ -50,6 +118,21 @@ class Token:
             return True
         return self.delivery_time + self.expires_in < time.time()
 
+    def needs_refresh(self):
+        """Check if current access token expires within the refresh margin"""
+        if self.delivery_time is None or self.expires_in is None:
+            return True
+        margin = getattr(settings, "NOTIFPY_TOKEN_REFRESH_MARGIN", 300)
+        return self.delivery_time + self.expires_in - margin < time.time()
+
+    def is_stale(self):
+        """Check if the token was saved by another process since loaded"""
+        version = models.Token.objects\
+            .filter(pk=1)\
+            .values_list("version", flat=True)\
+            .first()
+        return version != self.version
+
     def authorize(self, delivery):
         """Handle first token delivery"""
         self.access_token = delivery["access_token"]
@@ -66,6 +149,8 @@ class Token:
         self.access_token = delivery["access_token"]
         if "refresh_token" in delivery:
             self.refresh_token = delivery["refresh_token"]
+        if "expires_in" in delivery:
+            self.expires_in = delivery["expires_in"]
         self.delivery_time = time.time()
         self.save()
 
@@ -75,27 +160,33 @@ class Token:
         self.refresh_token = None
         self.expires_in = None
         self.delivery_time = None
+        self.save()
 
     def save(self):
-        """Export current token"""
-        obj = models.Token.load()
-        setattr(obj, self.field, json.dumps({
-            "access_token": self.access_token,
-            "refresh_token": self.refresh_token,
-            "expires_in": self.expires_in,
-            "delivery_time": self.delivery_time,
-        }))
-        obj.save()
+        """Export current token, bumping the version of the stored tokens"""
+        models.Token.load()
+        models.Token.objects.filter(pk=1).update(**{
+            self.field: json.dumps({
+                "access_token": self.access_token,
+                "refresh_token": self.refresh_token,
+                "expires_in": self.expires_in,
+                "delivery_time": self.delivery_time,
+            }),
+            "version": F("version") + 1,
+        })
+        self.version = models.Token.objects\
+            .values_list("version", flat=True)\
+            .get(pk=1)
 
     def load(self):
-        """Load token from a file"""
+        """Load token from the database"""
         obj = models.Token.load()
         dictionnary = json.loads(getattr(obj, self.field))
-        if len(dictionnary) > 0:
-            self.access_token = dictionnary["access_token"]
-            self.refresh_token = dictionnary["refresh_token"]
-            self.expires_in = dictionnary["expires_in"]
-            self.delivery_time = dictionnary["delivery_time"]
+        self.version = obj.version
+        self.access_token = dictionnary.get("access_token")
+        self.refresh_token = dictionnary.get("refresh_token")
+        self.expires_in = dictionnary.get("expires_in")
+        self.delivery_time = dictionnary.get("delivery_time")
 
     def delivery_datetime(self):
         """Format delivery time as a datetime object"""
@@ -120,7 +211,18 @@ class OAuthFlow:
         self.token_uri = uris["token"]
         self.revoke_uri = uris["revoke"]
         self.state = generate_random_state()
-        self.token = Token(token_field)
+        self.token = get_token(token_field)
+        self.session = requests.Session()
+        self.timeout = getattr(settings, "NOTIFPY_HTTP_TIMEOUT", 10)
+
+    def post(self, uri, params):
+        """Send a request to the authorization server, or return None if it
+        could not be reached in time"""
+        try:
+            return self.session.post(uri, params=params, timeout=self.timeout)
+        except requests.RequestException as error:
+            logging.error("Request to %s failed: %s", uri, error)
+            return None
 
     def get_authorize_url(self):
         """Return the authorization URL the user should be redirected too"""
@@ -145,13 +247,15 @@ class OAuthFlow:
             logging.error("Invalild state encountered")
             return
         logging.debug("Received valid code '%s'", request.GET["code"])
-        response = requests.post(self.token_uri, params={
+        response = self.post(self.token_uri, {
             "client_id": self.credentials.client_id,
             "client_secret": self.credentials.client_secret,
             "grant_type": "authorization_code",
             "redirect_uri": self.credentials.redirect_uri,
             "code": request.GET["code"]
         })
+        if response is None:
+            return
         if response.status_code != 200:
             logging.error(
                 "Invalid response status code %s",
@@ -161,37 +265,38 @@ class OAuthFlow:
         self.token.authorize(response.json())
 
     def refresh(self):
-        """Refresh the current token"""
+        """Refresh the current token. Return True on success."""
         logging.info("Refreshing token at %s", self.token_uri)
-        response = requests.post(
-            self.token_uri,
-            params={
-                "client_id": self.credentials.client_id,
-                "client_secret": self.credentials.client_secret,
-                "refresh_token": self.token.refresh_token,
-                "grant_type": "refresh_token"
-            }
-        )
+        response = self.post(self.token_uri, {
+            "client_id": self.credentials.client_id,
+            "client_secret": self.credentials.client_secret,
+            "refresh_token": self.token.refresh_token,
+            "grant_type": "refresh_token"
+        })
+        if response is None:
+            return False
         if response.status_code != 200:
             logging.error(
                 "Invalid response status code %d: %s",
                 response.status_code,
                 response.text,
             )
-            return
-        self.token.refresh(response.json())
+            return False
+        try:
+            self.token.refresh(response.json())
+        except (ValueError, KeyError):
+            logging.error("Invalid token response: %s", response.text)
+            return False
+        return True
 
     def revoke(self):
         """Revoke the current token"""
         logging.info("Revoking token at %s", self.revoke_uri)
-        response = requests.post(
-            self.revoke_uri,
-            params={
-                "client_id": self.credentials.client_id,
-                "token": self.token.access_token,
-            }
-        )
-        if response.status_code != 200:
+        response = self.post(self.revoke_uri, {
+            "client_id": self.credentials.client_id,
+            "token": self.token.access_token,
+        })
+        if response is not None and response.status_code != 200:
             logging.error(
                 "Invalid response status code %s",
                 response.status_code
@@ -201,35 +306,68 @@ class OAuthFlow:
 
 class QuotaBucket:
 
-    """Implements the tokens bucket algorithm."""
+    """Implements the tokens bucket algorithm. The bucket content is stored in
+    the database and consumed with a single conditional update, so that all
+    processes using an API share the same budget."""
+
+    MODE_REJECT = "reject"
+    MODE_WAIT = "wait"
 
-    def __init__(self, size, rate):
+    def __init__(self, name, size, rate):
+        self.name = name
         self.size = size
         self.rate = rate
-        self.content = size
-        self.last_content_update = time.time()
+        self.mode = getattr(settings, "NOTIFPY_QUOTA_MODE", QuotaBucket.MODE_REJECT)
+        self.max_wait = getattr(settings, "NOTIFPY_QUOTA_MAX_WAIT", 60)
+        self.initialized = False
 
-    def update(self):
-        """Refill the bucket since last update"""
-        now = time.time()
-        elapsed = now - self.last_content_update
-        to_add = int(elapsed * self.rate)
-        if to_add > 0:
-            self.content = min(self.size, self.content + to_add)
-            self.last_content_update = now
+    def load(self):
+        """Return the stored bucket state, creating a full bucket if needed"""
+        state, _ = models.QuotaState.objects.get_or_create(
+            name=self.name,
+            defaults={"content": self.size, "last_update": time.time()}
+        )
+        self.initialized = True
+        return state
+
+    def remaining(self):
+        """Return the current bucket content"""
+        state = self.load()
+        elapsed = max(0, time.time() - state.last_update)
+        return min(self.size, state.content + elapsed * self.rate)
 
     def get(self):
         """Return the current bucket filled ratio"""
-        self.update()
-        return self.content / self.size
+        return self.remaining() / self.size
+
+    def take(self, amount):
+        """Atomically refill the bucket and remove an amount from it, if it
+        holds enough. Return whether the amount was taken."""
+        if not self.initialized:
+            self.load()
+        now = time.time()
+        refill = Greatest(Value(now) - F("last_update"), Value(0.)) * Value(self.rate)
+        updated = models.QuotaState.objects\
+            .filter(name=self.name, content__gte=Value(float(amount)) - refill)\
+            .update(
+                content=Least(F("content") + refill, Value(float(self.size))) - Value(float(amount)),
+                last_update=Value(now),
+            )
+        return updated > 0
 
     def use(self, amount):
-        """Use a sip of the bucket"""
-        self.update()
-        if self.content >= amount:
-            self.content -= amount
-            return True
-        return False
+        """Use a sip of the bucket. In reject mode, fail immediately if the
+        bucket is empty. In wait mode, wait for it to refill, up to
+        max_wait seconds."""
+        deadline = time.time() + self.max_wait
+        while not self.take(amount):
+            if self.mode != QuotaBucket.MODE_WAIT:
+                return False
+            delay = max(.1, (amount - self.remaining()) / self.rate)
+            if time.time() + delay > deadline:
+                return False
+            time.sleep(delay)
+        return True
 
 
 class Endpoint:
@@ -239,22 +377,80 @@ class Endpoint:
     def __init__(self, oauth_flow, quota_bucket):
         self.oauth_flow = oauth_flow
         self.quota_bucket = quota_bucket
+        self.timeout = getattr(settings, "NOTIFPY_HTTP_TIMEOUT", 10)
+        self.session = create_session(
+            getattr(settings, "NOTIFPY_HTTP_POOL_SIZE", 10),
+            getattr(settings, "NOTIFPY_HTTP_RETRIES", 3),
+            getattr(settings, "NOTIFPY_HTTP_BACKOFF", .5),
+        )
+        self.oauth_flow.session = self.session
+        self.request_count = 0
+        self.error_count = 0
+
+    def refresh_token(self):
+        """Refresh the token unless another thread or process already did"""
+        token = self.oauth_flow.token
+        if not token.needs_refresh():
+            return
+        with process_lock("token-" + token.field):
+            if token.is_stale():
+                token.load()
+            if token.needs_refresh() and not self.oauth_flow.refresh():
+                logging.warning("Could not refresh %s token, keeping the current one",
+                                token.field)
+
+    def refresh_token_in_background(self):
+        """Refresh the token from a background thread. The token lock is
+        acquired by the caller and released here."""
+        try:
+            self.refresh_token()
+        finally:
+            self.oauth_flow.token.lock.release()
+            db.connection.close()
 
     def headers(self):
-        """Return the headers containing the access token"""
-        if self.oauth_flow.token.has_expired():
-            self.oauth_flow.refresh()
+        """Return the headers containing the access token. An expired token
+        is refreshed right away, a token about to expire is refreshed in the
+        background while the current one is still used."""
+        token = self.oauth_flow.token
+        if token.has_expired():
+            with token.lock:
+                self.refresh_token()
+        elif token.needs_refresh() and token.lock.acquire(blocking=False):
+            threading.Thread(
+                target=self.refresh_token_in_background,
+                daemon=True
+            ).start()
         return {
             "client-id": self.oauth_flow.credentials.client_id,
             "Authorization": "Bearer %s" % self.oauth_flow.token.access_token
         }
 
-    def get(self, url, params, cost):
-        """Execute a request"""
+    def get(self, url, params, cost, etag=None):
+        """Execute a request. If an ETag is given, the request is
+        conditional and an empty list is returned when nothing changed."""
         if not self.quota_bucket.use(cost):
-            logging.warning("Quota bucket is full!")
-        response = requests.get(url, params=params, headers=self.headers())
+            logging.warning("Quota bucket is empty, rejected request to %s", url)
+            return None
+        self.request_count += 1
+        try:
+            headers = self.headers()
+            if etag:
+                headers["If-None-Match"] = etag
+            response = self.session.get(
+                url,
+                params=params,
+                headers=headers,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as error:
+            self.error_count += 1
+            logging.error("Request to %s failed: %s", url, error)
+            return None
+        if etag and response.status_code == 304:
+            return {"etag": etag, "items": []}
         if not response.status_code == 200:
+            self.error_count += 1
             logging.error(
                 "Wrong answer from API (error %d): %s",
                 response.status_code,
@@ -263,11 +459,32 @@ class Endpoint:
             return None
         return response.json()
 
+    def metrics(self):
+        """Return request and connection reuse statistics, per host"""
+        hosts = dict()
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                if pool is None:
+                    continue
+                hosts[pool.host] = {
+                    "requests": pool.num_requests,
+                    "connections": pool.num_connections,
+                }
+        return {
+            "requests": self.request_count,
+            "errors": self.error_count,
+            "hosts": hosts,
+        }
+
 
 class YoutubeEndpoint(Endpoint):
 
     """YouTube endpoint"""
 
+    base_url = "https://www.googleapis.com/youtube/v3"
+
     def __init__(self, credentials):
         Endpoint.__init__(
             self,
@@ -281,6 +498,7 @@ class YoutubeEndpoint(Endpoint):
                 "youtube",
             ),
             QuotaBucket(
+                "youtube",
                 10000,
                 10000. / (24. * 3600.)
             ),
@@ -297,12 +515,12 @@ class YoutubeEndpoint(Endpoint):
         if channel_id is not None:
             params["id"] = channel_id
         return self.get(
-            "https://www.googleapis.com/youtube/v3/channels",
+            self.base_url + "/channels",
             params,
             5
         )
 
-    def playlist_items_list(self, playlist_id, part="snippet", page_token=None):
+    def playlist_items_list(self, playlist_id, part="snippet", page_token=None, etag=None):
         """https://developers.google.com/youtube/v3/docs/playlistItems/list"""
         params = {
             "part": part,
@@ -315,9 +533,10 @@ class YoutubeEndpoint(Endpoint):
         if part == "snippet":
             cost = 3
         return self.get(
-            "https://www.googleapis.com/youtube/v3/playlistItems",
+            self.base_url + "/playlistItems",
             params,
-            cost
+            cost,
+            etag=etag,
         )
 
     def search_list(self, channel_id=None, resource_type=None):
@@ -332,7 +551,7 @@ class YoutubeEndpoint(Endpoint):
         if resource_type is not None:
             params["type"] = resource_type
         return self.get(
-            "https://www.googleapis.com/youtube/v3/search",
+            self.base_url + "/search",
             params,
             100
         )
@@ -344,7 +563,7 @@ class YoutubeEndpoint(Endpoint):
             "id": video_id,
         }
         return self.get(
-            "https://www.googleapis.com/youtube/v3/videos",
+            self.base_url + "/videos",
             params,
             3
         )
@@ -367,6 +586,7 @@ class TwitchEndpoint(Endpoint):
                 "twitch",
             ),
             QuotaBucket(
+                "twitch",
                 800,
                 800 / 60
             ),
@@ -0,0 +1,181 @@
+"""This module maintains the materialized home feed of each user"""
+
+import re
+import logging
+import functools
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from . import models
+
+
+PATTERN_CACHE_SIZE = 10000
+PATTERN_CACHE_KEY = "notifpy:filters:%d:%s"
+PATTERN_TTL = getattr(settings, "NOTIFPY_PATTERN_TTL", 300)
+
+
+def compile_filters(regexes):
+    """Compile a list of filter regexes into a tuple of case insensitive
+    patterns, or return None if there is no valid filter. Regexes are
+    compiled separately, as inline flags or backreferences may not survive
+    being joined into a single pattern."""
+    patterns = list()
+    for regex in regexes:
+        try:
+            patterns.append(re.compile(regex, re.IGNORECASE))
+        except re.error:
+            logging.warning("Ignoring invalid filter regex %s", regex)
+    if len(patterns) == 0:
+        return None
+    return tuple(patterns)
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_cached_filters(regexes):
+    """Compile a tuple of filter regexes once per process"""
+    return compile_filters(list(regexes))
+
+
+def title_matches(pattern, title):
+    """Check if a video title passes a compiled filter, ie. matches any of
+    its patterns"""
+    return pattern is None or any(
+        regex.search(title) is not None for regex in pattern)
+
+
+def get_patterns(user_ids, channel_id):
+    """Return the compiled filters of several users for a channel, as a
+    dictionnary. The regexes are kept in Django's cache until the filters
+    of the channel change, or for PATTERN_TTL seconds, and compiled once
+    per process."""
+    keys = {user_id: PATTERN_CACHE_KEY % (user_id, channel_id) for user_id in user_ids}
+    cached = cache.get_many(list(keys.values()))
+    regexes = {user_id: cached[key] for user_id, key in keys.items() if key in cached}
+    missing = [user_id for user_id in user_ids if user_id not in regexes]
+    if len(missing) > 0:
+        fetched = {user_id: list() for user_id in missing}
+        for user_id, regex in models.Filter.objects\
+                .filter(channel_id=channel_id, user_id__in=missing)\
+                .values_list("user_id", "regex"):
+            fetched[user_id].append(regex)
+        fetched = {user_id: tuple(sorted(items)) for user_id, items in fetched.items()}
+        cache.set_many({keys[user_id]: items for user_id, items in fetched.items()}, PATTERN_TTL)
+        regexes.update(fetched)
+    return {
+        user_id: compile_cached_filters(regexes[user_id])
+        for user_id in user_ids
+    }
+
+
+def get_pattern(user_id, channel_id):
+    """Return the compiled filter of a user for a channel"""
+    return get_patterns([user_id], channel_id)[user_id]
+
+
+def invalidate_pattern(user_id, channel_id):
+    """Drop the cached filter of a user for a channel, now and once the
+    current transaction is committed"""
+    key = PATTERN_CACHE_KEY % (user_id, channel_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def make_entries(user_id, pattern, videos):
+    """Return the unsaved feed entries for the videos passing the filter"""
+    return [
+        models.FeedEntry(
+            user_id=user_id,
+            channel_id=video.channel_id,
+            video_id=video.id,
+            publication=video.publication,
+            gathering=video.gathering,
+        )
+        for video in videos
+        if title_matches(pattern, video.title)
+    ]
+
+
+def add_videos(channel, videos):
+    """Append freshly ingested videos to the feed of every subscriber"""
+    if len(videos) == 0:
+        return
+    user_ids = list(
+        models.YoutubeSubscription.objects
+        .filter(channel=channel)
+        .values_list("user_id", flat=True)
+    )
+    entries = list()
+    for user_id, pattern in get_patterns(user_ids, channel.id).items():
+        entries += make_entries(user_id, pattern, videos)
+    models.FeedEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def add_channels(user, channel_ids):
+    """Add the videos of freshly subscribed channels to the feed of a user,
+    with one query for the filters and one for the videos"""
+    regexes = {channel_id: list() for channel_id in channel_ids}
+    for channel_id, regex in models.Filter.objects\
+            .filter(user=user, channel_id__in=channel_ids)\
+            .values_list("channel_id", "regex"):
+        regexes[channel_id].append(regex)
+    regexes = {
+        channel_id: tuple(sorted(channel_regexes))
+        for channel_id, channel_regexes in regexes.items()
+    }
+    cache.set_many({
+        PATTERN_CACHE_KEY % (user.id, channel_id): channel_regexes
+        for channel_id, channel_regexes in regexes.items()
+    }, PATTERN_TTL)
+    patterns = {
+        channel_id: compile_cached_filters(channel_regexes)
+        for channel_id, channel_regexes in regexes.items()
+    }
+    videos = {channel_id: list() for channel_id in channel_ids}
+    for video in models.YoutubeVideo.objects\
+            .filter(channel_id__in=channel_ids)\
+            .only("id", "channel_id", "title", "publication", "gathering")\
+            .iterator():
+        videos[video.channel_id].append(video)
+    entries = list()
+    for channel_id, pattern in patterns.items():
+        entries += make_entries(user.id, pattern, videos[channel_id])
+    models.FeedEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+def remove_channel(user, channel):
+    """Remove the videos of a channel from the feed of a user"""
+    models.FeedEntry.objects.filter(user=user, channel=channel).delete()
+
+
+def remove_channels(user, channel_ids):
+    """Remove the videos of several channels from the feed of a user"""
+    models.FeedEntry.objects.filter(user=user, channel_id__in=channel_ids).delete()
+
+
+def rebuild_channel(user, channel):
+    """Recompute the feed entries of a user for a channel, after its
+    subscription or its filters changed"""
+    invalidate_pattern(user.id, channel.id)
+    with transaction.atomic():
+        remove_channel(user, channel)
+        if not models.YoutubeSubscription.objects\
+                .filter(user=user, channel=channel).exists():
+            return
+        models.FeedEntry.objects.bulk_create(
+            make_entries(
+                user.id,
+                get_pattern(user.id, channel.id),
+                channel.youtubevideo_set.only(
+                    "id", "channel_id", "title", "publication", "gathering"),
+            ),
+            ignore_conflicts=True,
+        )
+
+
+def rebuild_user(user):
+    """Recompute the whole feed of a user"""
+    with transaction.atomic():
+        models.FeedEntry.objects.filter(user=user).delete()
+        for subscription in models.YoutubeSubscription.objects\
+                .filter(user=user).select_related("channel"):
+            rebuild_channel(user, subscription.channel)
@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from notifpy import models
+from notifpy import retention
+
+
+class Command(BaseCommand):
+    """Remove old videos from the database"""
+    help = "Remove old videos from the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-o", "--older-than",
+            type=int,
+            default=2592000,
+            help="Default retention window, in seconds."
+        )
+        parser.add_argument(
+            "-w", "--window",
+            action="append",
+            default=[],
+            metavar="PRIORITY=SECONDS",
+            help="Retention window for a channel priority (-1 to 2)."
+        )
+        parser.add_argument(
+            "-c", "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of videos deleted per transaction."
+        )
+        parser.add_argument(
+            "-n", "--dry-run",
+            action="store_true",
+            help="Only count the videos that would be deleted."
+        )
+
+    def handle(self, *args, **kwargs):
+        windows = dict()
+        for window in kwargs["window"]:
+            try:
+                priority, seconds = map(int, window.split("="))
+            except ValueError:
+                raise CommandError("Invalid window '%s'" % window)
+            windows[priority] = seconds
+        if kwargs["dry_run"]:
+            counts = retention.count_old_videos(kwargs["older_than"], windows)
+            labels = dict(models.YoutubeChannel.PRIORITY_CHOICES)
+            for priority, count in sorted(counts.items()):
+                self.stdout.write("%s: %d videos" % (labels.get(priority, priority), count))
+            self.stdout.write("Total: %d videos would be deleted" % sum(counts.values()))
+            return
+        start = time.time()
+
+        def progress(deleted):
+            self.stdout.write("Deleted %d videos (%.0f/s)" % (
+                deleted, deleted / max(time.time() - start, 1e-6)))
+        deleted = retention.clear_old_videos(
+            kwargs["older_than"],
+            windows,
+            kwargs["chunk_size"],
+            progress
+        )
+        self.stdout.write("Deleted %d videos in %.1f s" % (deleted, time.time() - start))
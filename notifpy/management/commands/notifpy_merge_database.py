@@ -1,11 +1,46 @@
+import os
 import re
+import json
+import time
 import sqlite3
+import contextlib
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from notifpy import feed
 from notifpy import models
 
 
+def parse_date(value):
+    """Parse a date stored by Django in a SQLite database"""
+    if value is None:
+        return None
+    date = parse_datetime(value)
+    if date is not None and timezone.is_naive(date):
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+@contextlib.contextmanager
+def keep_dates(*fields):
+    """Disable auto_now_add on some fields, so that dates from the source
+    database are kept by bulk_create"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
 class Command(BaseCommand):
-    """Merge an external database"""
+    """Merge an external database. Rows are streamed by chunks and inserted
+    in bulk, existing rows are kept untouched. Progress is saved after each
+    chunk in a checkpoint file, so that an interrupted merge can resume."""
     help = "Merge an external database"
 
     def add_arguments(self, parser):
@@ -14,56 +49,357 @@ class Command(BaseCommand):
             type=str,
             help="Path to the external database."
         )
+        parser.add_argument(
+            "-c", "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of rows read and inserted at once."
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=str,
+            default=None,
+            help="Path to the checkpoint file (defaults to FILENAME.checkpoint)."
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore any existing checkpoint."
+        )
 
     def handle(self, *args, **kwargs):
-        filename = kwargs["filename"]
-        connection = sqlite3.connect(filename)
-        cursor = connection.cursor()
-        youtube_channels = dict()
-        print("Loading YouTube channels")
-        iterator = list(cursor.execute("SELECT id, title, slug, priority, thumbnail, last_update, playlist_id FROM notifpy_youtubechannel"))
-        for i, row in enumerate(iterator):
-            channel_id, title, slug, priority, thumbnail, last_update, playlist_id = row
-            print("%d/%d: %s" % (i + 1, len(iterator), title))
-            if models.YoutubeChannel.objects.filter(id=channel_id).exists():
-                youtube_channels[channel_id] = models.YoutubeChannel.objects.get(
-                    id=channel_id
-                )
-            else:
-                youtube_channels[channel_id] = models.YoutubeChannel.objects.create(
-                    id=channel_id,
-                    title=title,
-                    slug=slug,
-                    priority=priority,
-                    thumbnail=thumbnail,
-                    last_update=last_update,
-                    playlist_id=playlist_id
-                )
-        print("Loading filters")
-        iterator = list(cursor.execute("SELECT id, regex, channel_id FROM notifpy_filter"))
-        for i, row in enumerate(iterator):
-            _, regex, channel_id = row
-            channel = youtube_channels[channel_id]
-            regex = re.sub("\r", "", regex)
-            print("%d/%d: %s" % (i + 1, len(iterator), regex.encode("utf8")))
-            if models.Filter.objects.filter(channel=channel, regex=regex).exists():
-                continue
-            models.Filter.objects.create(
-                channel=channel,
-                regex=regex,
+        self.chunk_size = kwargs["chunk_size"]
+        self.checkpoint_path = kwargs["checkpoint"] or kwargs["filename"] + ".checkpoint"
+        self.checkpoint = dict()
+        if os.path.isfile(self.checkpoint_path) and not kwargs["restart"]:
+            with open(self.checkpoint_path) as file:
+                self.checkpoint = json.load(file)
+            self.stdout.write("Resuming from %s" % self.checkpoint_path)
+        self.connection = sqlite3.connect(kwargs["filename"])
+        self.users = self.map_users()
+        self.merge_youtube_channels()
+        self.merge_twitch_users()
+        self.merge_twitch_games()
+        self.merge_youtube_videos()
+        self.merge_filters()
+        self.merge_playlists()
+        self.merge_playlist_rules()
+        self.merge_playlist_memberships()
+        self.merge_subscriptions("notifpy_youtubesubscription", models.YoutubeSubscription)
+        self.merge_subscriptions("notifpy_twitchsubscription", models.TwitchSubscription)
+        self.merge_subscription_histories()
+        self.connection.close()
+        self.stdout.write("Rebuilding feeds")
+        for user in User.objects.filter(youtubesubscription__isnull=False).distinct():
+            feed.rebuild_user(user)
+        if os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def columns(self, table):
+        """Return the columns of a source table"""
+        return {
+            row[1]
+            for row in self.connection.execute("PRAGMA table_info(%s)" % table)
+        }
+
+    def stream(self, table, columns):
+        """Yield chunks of rows from a source table, starting after the last
+        checkpoint. Missing columns are read as NULL."""
+        available = self.columns(table)
+        if len(available) == 0:
+            self.stdout.write("Skipping %s, missing from source" % table)
+            return
+        expressions = [
+            '"%s"' % column if column in available else "NULL"
+            for column in columns
+        ]
+        cursor = self.connection.execute(
+            "SELECT rowid, %s FROM %s WHERE rowid > ? ORDER BY rowid" % (
+                ", ".join(expressions), table),
+            (self.checkpoint.get(table, 0),)
+        )
+        start = time.time()
+        total = 0
+        while True:
+            rows = cursor.fetchmany(self.chunk_size)
+            if len(rows) == 0:
+                break
+            yield [row[1:] for row in rows]
+            total += len(rows)
+            self.checkpoint[table] = rows[-1][0]
+            with open(self.checkpoint_path, "w") as file:
+                json.dump(self.checkpoint, file)
+            self.stdout.write("%s: %d rows (%.0f rows/s)" % (
+                table, total, total / max(time.time() - start, 1e-6)))
+
+    def insert(self, model, objects):
+        """Bulk insert objects, ignoring the ones that conflict"""
+        model.objects.bulk_create(
+            objects,
+            batch_size=500,
+            ignore_conflicts=True
+        )
+
+    def map_users(self):
+        """Match source users with target users by username"""
+        if len(self.columns("auth_user")) == 0:
+            return dict()
+        usernames = dict(self.connection.execute("SELECT id, username FROM auth_user"))
+        targets = dict(
+            User.objects
+            .filter(username__in=usernames.values())
+            .values_list("username", "id")
+        )
+        return {
+            source_id: targets[username]
+            for source_id, username in usernames.items()
+            if username in targets
+        }
+
+    def merge_youtube_channels(self):
+        table = "notifpy_youtubechannel"
+        for rows in self.stream(table, ["id", "title", "slug", "priority", "thumbnail", "last_update", "playlist_id"]):
+            existing = set(
+                models.YoutubeChannel.objects
+                .filter(id__in=[row[0] for row in rows])
+                .values_list("id", flat=True)
             )
-        print("Loading Twitch users")
-        iterator = list(cursor.execute("SELECT id, login, display_name, profile_image_url, offline_image_url FROM notifpy_twitchuser"))
-        for i, row in enumerate(iterator):
-            user_id, login, display_name, profile_image_url, offline_image_url = row
-            print("%d/%d: %s" % (i + 1, len(iterator), display_name))
-            if models.TwitchUser.objects.filter(id=user_id).exists():
-                continue
-            models.TwitchUser.objects.create(
-                id=user_id,
-                login=login,
-                display_name=display_name,
-                profile_image_url=profile_image_url,
-                offline_image_url=offline_image_url,
+            with transaction.atomic():
+                self.insert(models.YoutubeChannel, [
+                    models.YoutubeChannel(
+                        id=channel_id,
+                        title=title,
+                        slug=slug,
+                        priority=priority,
+                        thumbnail=thumbnail,
+                        last_update=parse_date(last_update),
+                        playlist_id=playlist_id or "",
+                    )
+                    for channel_id, title, slug, priority, thumbnail, last_update, playlist_id in rows
+                    if channel_id not in existing
+                ])
+
+    def merge_twitch_users(self):
+        table = "notifpy_twitchuser"
+        for rows in self.stream(table, ["id", "login", "display_name", "profile_image_url", "offline_image_url"]):
+            existing = set(
+                models.TwitchUser.objects
+                .filter(id__in=[row[0] for row in rows])
+                .values_list("id", flat=True)
+            )
+            with transaction.atomic():
+                self.insert(models.TwitchUser, [
+                    models.TwitchUser(
+                        id=user_id,
+                        login=login,
+                        display_name=display_name,
+                        profile_image_url=profile_image_url,
+                        offline_image_url=offline_image_url,
+                    )
+                    for user_id, login, display_name, profile_image_url, offline_image_url in rows
+                    if user_id not in existing
+                ])
+
+    def merge_twitch_games(self):
+        table = "notifpy_twitchgame"
+        for rows in self.stream(table, ["id", "name", "box_art_url"]):
+            with transaction.atomic():
+                self.insert(models.TwitchGame, [
+                    models.TwitchGame(id=game_id, name=name, box_art_url=box_art_url)
+                    for game_id, name, box_art_url in rows
+                ])
+
+    def merge_youtube_videos(self):
+        table = "notifpy_youtubevideo"
+        gathering = models.YoutubeVideo._meta.get_field("gathering")
+        for rows in self.stream(table, ["id", "channel_id", "title", "publication", "gathering", "thumbnail"]):
+            existing = set(
+                models.YoutubeVideo.objects
+                .filter(id__in=[row[0] for row in rows])
+                .values_list("id", flat=True)
+            )
+            channels = set(
+                models.YoutubeChannel.objects
+                .filter(id__in={row[1] for row in rows})
+                .values_list("id", flat=True)
             )
-        connection.close()
+            with transaction.atomic(), keep_dates(gathering):
+                self.insert(models.YoutubeVideo, [
+                    models.YoutubeVideo(
+                        id=video_id,
+                        channel_id=channel_id,
+                        title=title,
+                        publication=parse_date(publication),
+                        gathering=parse_date(gathering_date) or timezone.now(),
+                        thumbnail=thumbnail,
+                    )
+                    for video_id, channel_id, title, publication, gathering_date, thumbnail in rows
+                    if video_id not in existing and channel_id in channels
+                ])
+
+    def merge_filters(self):
+        table = "notifpy_filter"
+        for rows in self.stream(table, ["user_id", "channel_id", "regex"]):
+            rows = [
+                (self.users.get(user_id or 1), channel_id, re.sub("\r", "", regex))
+                for user_id, channel_id, regex in rows
+            ]
+            existing = set(
+                models.Filter.objects
+                .filter(channel_id__in={row[1] for row in rows})
+                .values_list("user_id", "channel_id", "regex")
+            )
+            channels = set(
+                models.YoutubeChannel.objects
+                .filter(id__in={row[1] for row in rows})
+                .values_list("id", flat=True)
+            )
+            with transaction.atomic():
+                self.insert(models.Filter, [
+                    models.Filter(user_id=user_id, channel_id=channel_id, regex=regex)
+                    for user_id, channel_id, regex in set(rows) - existing
+                    if user_id is not None and channel_id in channels
+                ])
+
+    def merge_playlists(self):
+        table = "notifpy_playlist"
+        for rows in self.stream(table, ["slug", "title", "public", "owner_id"]):
+            existing = set(
+                models.Playlist.objects
+                .filter(slug__in=[row[0] for row in rows])
+                .values_list("slug", flat=True)
+            )
+            with transaction.atomic():
+                self.insert(models.Playlist, [
+                    models.Playlist(
+                        slug=slug,
+                        title=title,
+                        public=bool(public),
+                        owner_id=self.users[owner_id],
+                    )
+                    for slug, title, public, owner_id in rows
+                    if slug not in existing and owner_id in self.users
+                ])
+
+    def map_playlists(self):
+        """Match source playlists with target playlists by slug"""
+        if len(self.columns("notifpy_playlist")) == 0:
+            return dict()
+        slugs = dict(self.connection.execute("SELECT id, slug FROM notifpy_playlist"))
+        targets = dict(
+            models.Playlist.objects
+            .filter(slug__in=slugs.values())
+            .values_list("slug", "id")
+        )
+        return {
+            source_id: targets[slug]
+            for source_id, slug in slugs.items()
+            if slug in targets
+        }
+
+    def merge_playlist_rules(self):
+        table = "notifpy_playlist_rules"
+        playlists = self.map_playlists()
+        through = models.Playlist.rules.through
+        for rows in self.stream(table, ["playlist_id", "youtubechannel_id"]):
+            channels = set(
+                models.YoutubeChannel.objects
+                .filter(id__in={row[1] for row in rows})
+                .values_list("id", flat=True)
+            )
+            with transaction.atomic():
+                self.insert(through, [
+                    through(playlist_id=playlists[playlist_id], youtubechannel_id=channel_id)
+                    for playlist_id, channel_id in rows
+                    if playlist_id in playlists and channel_id in channels
+                ])
+
+    def merge_playlist_memberships(self):
+        table = "notifpy_playlistmembership"
+        playlists = self.map_playlists()
+        offsets = {
+            playlist.id: playlist.next_order()
+            for playlist in models.Playlist.objects.filter(id__in=set(playlists.values()))
+        }
+        touched = set()
+        addition = models.PlaylistMembership._meta.get_field("addition")
+        for rows in self.stream(table, ["playlist_id", "video_id", "addition", "order"]):
+            rows = [
+                (playlists[playlist_id], video_id, addition_date,
+                 offsets[playlists[playlist_id]] + max(0, order or 0))
+                for playlist_id, video_id, addition_date, order in rows
+                if playlist_id in playlists
+            ]
+            touched |= {row[0] for row in rows}
+            existing = set(
+                models.PlaylistMembership.objects
+                .filter(playlist_id__in={row[0] for row in rows}, video_id__in={row[1] for row in rows})
+                .values_list("playlist_id", "video_id")
+            )
+            videos = set(
+                models.YoutubeVideo.objects
+                .filter(id__in={row[1] for row in rows})
+                .values_list("id", flat=True)
+            )
+            with transaction.atomic(), keep_dates(addition):
+                self.insert(models.PlaylistMembership, [
+                    models.PlaylistMembership(
+                        playlist_id=playlist_id,
+                        video_id=video_id,
+                        addition=parse_date(addition_date) or timezone.now(),
+                        order=order,
+                    )
+                    for playlist_id, video_id, addition_date, order in rows
+                    if (playlist_id, video_id) not in existing and video_id in videos
+                ])
+        for playlist in models.Playlist.objects.filter(id__in=touched):
+            playlist.set_orders([])
+        cache.delete_many([
+            models.PLAYLIST_IDS_CACHE_KEY % playlist_id
+            for playlist_id in playlists.values()
+        ])
+
+    def merge_subscriptions(self, table, model):
+        target_model = model._meta.get_field("channel").related_model
+        for rows in self.stream(table, ["user_id", "channel_id"]):
+            channels = set(
+                target_model.objects
+                .filter(id__in={row[1] for row in rows})
+                .values_list("id", flat=True)
+            )
+            with transaction.atomic():
+                self.insert(model, [
+                    model(user_id=self.users[user_id], channel_id=channel_id)
+                    for user_id, channel_id in rows
+                    if user_id in self.users and channel_id in channels
+                ])
+
+    def merge_subscription_histories(self):
+        if len(self.columns("notifpy_subscriptionhistory")) == 0:
+            return
+        histories = dict()
+        for history_id, user_id in self.connection.execute(
+                "SELECT id, user_id FROM notifpy_subscriptionhistory"):
+            if user_id in self.users:
+                histories[history_id], _ = models.SubscriptionHistory.objects\
+                    .get_or_create(user_id=self.users[user_id])
+        for field, column, target_model in [
+                ("youtube", "youtubechannel_id", models.YoutubeChannel),
+                ("twitch", "twitchuser_id", models.TwitchUser)]:
+            table = "notifpy_subscriptionhistory_" + field
+            through = getattr(models.SubscriptionHistory, field).through
+            for rows in self.stream(table, ["subscriptionhistory_id", column]):
+                targets = set(
+                    target_model.objects
+                    .filter(id__in={row[1] for row in rows})
+                    .values_list("id", flat=True)
+                )
+                with transaction.atomic():
+                    self.insert(through, [
+                        through(**{
+                            "subscriptionhistory_id": histories[history_id].id,
+                            column: target_id,
+                        })
+                        for history_id, target_id in rows
+                        if history_id in histories and target_id in targets
+                    ])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from notifpy.operator import Operator
+from notifpy import models
+
+
+class Command(BaseCommand):
+    """Refresh the profiles of all Twitch users"""
+    help = "Refresh the profiles of all Twitch users"
+
+    def handle(self, *args, **kwargs):
+        operator = Operator()
+        if operator.twitch is None:
+            print("Twitch API is not configured")
+            return
+        updated = operator.refresh_twitch_users()
+        print("Updated %d out of %d Twitch users" % (
+            updated, models.TwitchUser.objects.count()))
+        metrics = operator.twitch.metrics()
+        print("Sent %d requests (%d errors)" % (metrics["requests"], metrics["errors"]))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from notifpy.operator import Operator
+from notifpy.endpoint import QuotaBucket
+from notifpy.operator import Operator, SOURCES, SOURCE_API
 
 
 class Command(BaseCommand):
@@ -8,6 +9,11 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("-p", "--priority", type=int, help="Select priority level for update.")
+        parser.add_argument("-w", "--workers", type=int, default=1, help="Number of concurrent API requests.")
+        parser.add_argument("--wait-quota", type=int, default=None, metavar="SECONDS",
+                            help="Wait up to this many seconds for the quota to refill instead of skipping requests.")
+        parser.add_argument("-s", "--source", choices=SOURCES, default=SOURCE_API,
+                            help="Read uploads from the Data API or from the RSS feeds, which cost no quota.")
 
     def handle(self, *args, **kwargs):
         priority = kwargs["priority"]
@@ -16,4 +22,18 @@ class Command(BaseCommand):
         else:
             priorities = [priority]
         operator = Operator()
-        operator.update_channels(priorities, verbose=True)
+        if operator.youtube is not None and kwargs["wait_quota"] is not None:
+            operator.youtube.quota_bucket.mode = QuotaBucket.MODE_WAIT
+            operator.youtube.quota_bucket.max_wait = kwargs["wait_quota"]
+        operator.update_channels(
+            priorities,
+            verbose=True,
+            workers=kwargs["workers"],
+            source=kwargs["source"]
+        )
+        if operator.youtube is not None:
+            metrics = operator.youtube.metrics()
+            print("Sent %d requests (%d errors)" % (metrics["requests"], metrics["errors"]))
+            for host, stats in metrics["hosts"].items():
+                print("%s: %d requests over %d connections" % (
+                    host, stats["requests"], stats["connections"]))
@@ -0,0 +1,45 @@
+import requests
+from django.core.management.base import BaseCommand
+from notifpy import models
+from notifpy import websub
+
+
+class Command(BaseCommand):
+    """Renew the WebSub leases of scheduled YouTube channels"""
+    help = "Renew the WebSub leases of scheduled YouTube channels"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-m", "--margin",
+            type=int,
+            default=86400,
+            help="Renew the leases expiring within this many seconds."
+        )
+        parser.add_argument(
+            "--unsubscribe",
+            action="store_true",
+            help="Cancel every lease instead."
+        )
+
+    def handle(self, *args, **kwargs):
+        if not websub.is_enabled():
+            print("NOTIFPY_WEBSUB_CALLBACK_BASE is not set")
+            return
+        session = requests.Session()
+        if kwargs["unsubscribe"]:
+            subscribe = list()
+            unsubscribe = [
+                lease.channel
+                for lease in models.WebSubLease.objects.select_related("channel")
+            ]
+        else:
+            subscribe = list(websub.channels_to_renew(kwargs["margin"]))
+            unsubscribe = [lease.channel for lease in websub.leases_to_cancel()]
+        accepted = 0
+        for channel in subscribe:
+            accepted += websub.request_lease(channel, session=session)
+        for channel in unsubscribe:
+            accepted += websub.request_lease(
+                channel, models.WebSubLease.MODE_UNSUBSCRIBE, session=session)
+        print("Sent %d subscription and %d unsubscription requests, %d accepted" % (
+            len(subscribe), len(unsubscribe), accepted))
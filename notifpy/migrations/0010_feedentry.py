@@ -0,0 +1,87 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:24
+
+import re
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def compile_filters(regexes):
+    """Frozen copy of notifpy.feed.compile_filters"""
+    patterns = list()
+    for regex in regexes:
+        try:
+            patterns.append(re.compile(regex, re.IGNORECASE))
+        except re.error:
+            continue
+    if len(patterns) == 0:
+        return None
+    return tuple(patterns)
+
+
+def title_matches(pattern, title):
+    """Frozen copy of notifpy.feed.title_matches"""
+    return pattern is None or any(
+        regex.search(title) is not None for regex in pattern)
+
+
+def populate_feed(apps, schema_editor):
+    FeedEntry = apps.get_model("notifpy", "FeedEntry")
+    Filter = apps.get_model("notifpy", "Filter")
+    YoutubeSubscription = apps.get_model("notifpy", "YoutubeSubscription")
+    YoutubeVideo = apps.get_model("notifpy", "YoutubeVideo")
+    for subscription in YoutubeSubscription.objects.all():
+        pattern = compile_filters(list(Filter.objects.filter(
+            user_id=subscription.user_id,
+            channel_id=subscription.channel_id,
+        ).values_list("regex", flat=True)))
+        FeedEntry.objects.bulk_create([
+            FeedEntry(
+                user_id=subscription.user_id,
+                channel_id=subscription.channel_id,
+                video_id=video.id,
+                publication=video.publication,
+                gathering=video.gathering,
+            )
+            for video in YoutubeVideo.objects.filter(channel_id=subscription.channel_id)
+            if title_matches(pattern, video.title)
+        ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('notifpy', '0009_filter_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publication', models.DateTimeField()),
+                ('gathering', models.DateTimeField()),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='notifpy.youtubechannel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='notifpy.youtubevideo')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-publication'], name='feed_user_publication'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-gathering'], name='feed_user_gathering'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'channel'], name='feed_user_channel'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'video'), name='unique_feed_entry'),
+        ),
+        migrations.RunPython(populate_feed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0010_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='youtubechannel',
+            name='last_video_id',
+            field=models.CharField(blank=True, default='', max_length=11),
+        ),
+        migrations.AddField(
+            model_name='youtubechannel',
+            name='playlist_etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:28
+
+import zlib
+import datetime
+from django.db import migrations, models
+
+
+DAY = datetime.timedelta(days=1)
+
+
+def phase(channel_id):
+    """Frozen copy of notifpy.scheduler.phase"""
+    return (zlib.crc32(channel_id.encode("utf8")) % 1000) / 1000.
+
+
+def spread_updates(apps, schema_editor):
+    """Spread the first scheduled updates of existing channels over a day,
+    so that they do not all fall due at once"""
+    from django.utils import timezone
+    YoutubeChannel = apps.get_model("notifpy", "YoutubeChannel")
+    now = timezone.now()
+    channels = list(YoutubeChannel.objects.all())
+    for channel in channels:
+        channel.next_update = now + DAY * phase(channel.id)
+    YoutubeChannel.objects.bulk_update(channels, ["next_update"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0011_youtubechannel_etag'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='UpdateSchedule',
+        ),
+        migrations.AddField(
+            model_name='youtubechannel',
+            name='next_update',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(spread_updates, migrations.RunPython.noop),
+    ]
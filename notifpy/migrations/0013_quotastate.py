@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0012_adaptive_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaState',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('content', models.FloatField()),
+                ('last_update', models.FloatField()),
+            ],
+        ),
+    ]
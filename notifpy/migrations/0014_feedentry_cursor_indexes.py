@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0013_quotastate'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='feedentry',
+            name='feed_user_publication',
+        ),
+        migrations.RemoveIndex(
+            model_name='feedentry',
+            name='feed_user_gathering',
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-publication', '-video'], name='feed_user_publication_video'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-gathering', '-video'], name='feed_user_gathering_video'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    """Keep a single subscription per user and channel, so that the unique
+    constraints can be created"""
+    for model_name in ["YoutubeSubscription", "TwitchSubscription"]:
+        model = apps.get_model("notifpy", model_name)
+        seen = set()
+        duplicates = list()
+        for pk, user_id, channel_id in model.objects\
+                .order_by("pk")\
+                .values_list("pk", "user_id", "channel_id"):
+            if (user_id, channel_id) in seen:
+                duplicates.append(pk)
+            seen.add((user_id, channel_id))
+        model.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0014_feedentry_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='filter',
+            index=models.Index(fields=['user', 'channel'], name='filter_user_channel'),
+        ),
+        migrations.AddIndex(
+            model_name='youtubevideo',
+            index=models.Index(fields=['channel', '-publication'], name='video_channel_publication'),
+        ),
+        migrations.AddIndex(
+            model_name='youtubevideo',
+            index=models.Index(fields=['gathering'], name='video_gathering'),
+        ),
+        migrations.AddConstraint(
+            model_name='twitchsubscription',
+            constraint=models.UniqueConstraint(fields=('user', 'channel'), name='unique_twitch_subscription'),
+        ),
+        migrations.AddConstraint(
+            model_name='youtubesubscription',
+            constraint=models.UniqueConstraint(fields=('user', 'channel'), name='unique_youtube_subscription'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0015_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playlistmembership',
+            index=models.Index(fields=['playlist', 'order'], name='membership_playlist_order'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0016_membership_order_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
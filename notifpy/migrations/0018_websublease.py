@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0017_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebSubLease',
+            fields=[
+                ('channel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='notifpy.youtubechannel')),
+                ('secret', models.CharField(max_length=64)),
+                ('mode', models.CharField(default='subscribe', max_length=16)),
+                ('requested', models.DateTimeField(auto_now=True)),
+                ('expiration', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
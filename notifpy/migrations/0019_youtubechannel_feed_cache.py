@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0018_websublease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='youtubechannel',
+            name='feed_etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='youtubechannel',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
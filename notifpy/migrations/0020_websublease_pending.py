@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifpy', '0019_youtubechannel_feed_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='websublease',
+            name='pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -3,11 +3,26 @@
 import random
 import json
 import re
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.text import slugify
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 
 
+PLAYLIST_IDS_CACHE_KEY = "notifpy:playlist-ids:%d"
+PLAYLIST_IDS_TTL = getattr(settings, "NOTIFPY_PLAYLIST_IDS_TTL", 3600)
+
+
+def invalidate_playlist_ids(playlist_id):
+    """Drop the cached video ids of a playlist, once the current transaction
+    commits"""
+    key = PLAYLIST_IDS_CACHE_KEY % playlist_id
+    transaction.on_commit(lambda: cache.delete(key))
+
+
 class SingletonModel(models.Model):
 
     class Meta:
@@ -43,6 +58,11 @@ class Token(SingletonModel):
 
     youtube = models.TextField(default="{}")
     twitch = models.TextField(default="{}")
+    version = models.PositiveIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        self.version += 1
+        SingletonModel.save(self, *args, **kwargs)
 
     def get_youtube(self):
         return json.loads(self.youtube)
@@ -51,6 +71,18 @@ class Token(SingletonModel):
         return json.loads(self.twitch)
 
 
+class QuotaState(models.Model):
+
+    """Store the content of an API quota bucket, shared by all processes"""
+
+    name = models.CharField(max_length=32, primary_key=True)
+    content = models.FloatField()
+    last_update = models.FloatField()
+
+    def __str__(self):
+        return "QuotaState<%s: %.1f>" % (self.name, self.content)
+
+
 class YoutubeVideo(models.Model):
 
     """Represent a YouTube video"""
@@ -62,6 +94,12 @@ class YoutubeVideo(models.Model):
     gathering = models.DateTimeField(auto_now_add=True, auto_now=False)
     thumbnail = models.URLField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["channel", "-publication"], name="video_channel_publication"),
+            models.Index(fields=["gathering"], name="video_gathering"),
+        ]
+
     def __str__(self):
         return "[{id}] {title}".format(id=self.id, title=self.title)
 
@@ -96,7 +134,12 @@ class YoutubeChannel(models.Model):
     thumbnail = models.URLField()
     last_update = models.DateTimeField(
         auto_now_add=False, auto_now=False, blank=True, null=True)
+    next_update = models.DateTimeField(blank=True, null=True, db_index=True)
     playlist_id = models.CharField(max_length=255)
+    playlist_etag = models.CharField(max_length=255, blank=True, default="")
+    last_video_id = models.CharField(max_length=11, blank=True, default="")
+    feed_etag = models.CharField(max_length=255, blank=True, default="")
+    feed_last_modified = models.CharField(max_length=64, blank=True, default="")
 
     def __str__(self):
         return self.title
@@ -114,9 +157,39 @@ class YoutubeChannel(models.Model):
             YoutubeChannel.PRIORITY_HIGH: "High"
         }[self.priority]
 
-    def video_is_valid(self, title):
-        """Check if a video is valid regarding filters"""
-        return True
+    def video_is_valid(self, title, user=None):
+        """Check if a video is valid regarding the filters of a user. Videos
+        are always stored, filters only apply to the feed of each user."""
+        if user is None:
+            return True
+        from .feed import get_pattern, title_matches
+        return title_matches(get_pattern(user.id, self.id), title)
+
+
+class WebSubLease(models.Model):
+
+    """Represent a WebSub subscription to the uploads of a YouTube channel"""
+
+    MODE_SUBSCRIBE = "subscribe"
+    MODE_UNSUBSCRIBE = "unsubscribe"
+
+    channel = models.OneToOneField(
+        "YoutubeChannel",
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    secret = models.CharField(max_length=64)
+    mode = models.CharField(max_length=16, default=MODE_SUBSCRIBE)
+    requested = models.DateTimeField(auto_now=True)
+    pending = models.BooleanField(default=False)
+    expiration = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return "WebSubLease<%s (%s until %s)>" % (
+            self.channel_id,
+            self.mode,
+            self.expiration
+        )
 
 
 class Filter(models.Model):
@@ -127,6 +200,11 @@ class Filter(models.Model):
     channel = models.ForeignKey("YoutubeChannel", on_delete=models.CASCADE)
     regex = models.CharField(max_length=255, default=".*")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "channel"], name="filter_user_channel"),
+        ]
+
     def __str__(self):
         return "Filter<User: %s, Channel: %s; Regex: %s>" % (
             self.user,
@@ -161,37 +239,77 @@ class Playlist(models.Model):
         """Return all memberships of the playlist, ranked"""
         return self.playlistmembership_set.all().order_by("order")
 
+    def video_ids(self):
+        """Return the ids of the videos in the playlist, ranked. The list is
+        cached until the memberships change."""
+        key = PLAYLIST_IDS_CACHE_KEY % self.pk
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.get_videos().values_list("video_id", flat=True))
+            cache.set(key, ids, PLAYLIST_IDS_TTL)
+        return ids
+
+    def invalidate_video_ids(self):
+        """Drop the cached video ids, once the current transaction commits"""
+        invalidate_playlist_ids(self.pk)
+
+    def next_order(self):
+        """Return the order of a video appended to the playlist"""
+        last = self.playlistmembership_set.aggregate(models.Max("order"))["order__max"]
+        return 0 if last is None else last + 1
+
+    def set_orders(self, membership_ids):
+        """Rank memberships following the given ids, the others being moved
+        after them in their current order. Orders are rewritten within one
+        transaction, with a single bulk update."""
+        with transaction.atomic():
+            memberships = list(self.get_videos().only("id", "playlist", "order"))
+            ranks = {membership_id: i for i, membership_id in enumerate(membership_ids)}
+            memberships.sort(key=lambda membership: (
+                ranks.get(membership.id, len(ranks)),
+                membership.order
+            ))
+            changed = list()
+            for i, membership in enumerate(memberships):
+                if membership.order != i:
+                    membership.order = i
+                    changed.append(membership)
+            PlaylistMembership.objects.bulk_update(changed, ["order"])
+            self.invalidate_video_ids()
+
     def shift_orders(self):
         """Reset ordering so the first item is at 0 and increment is always 1"""
-        for i, membership in enumerate(self.get_videos()):
-            membership.order = i
-            membership.save()
+        self.set_orders([])
+
+    def swap_orders(self, order, other):
+        """Swap the videos at two orders"""
+        with transaction.atomic():
+            memberships = list(self.playlistmembership_set
+                               .filter(order__in=[order, other])
+                               .only("id", "playlist", "order"))
+            if len(memberships) != 2:
+                return
+            memberships[0].order, memberships[1].order = memberships[1].order, memberships[0].order
+            PlaylistMembership.objects.bulk_update(memberships, ["order"])
+            self.invalidate_video_ids()
+
+    def remove_video(self, video_id):
+        """Remove every occurrence of a video from the playlist, and close
+        the gaps they leave"""
+        with transaction.atomic():
+            self.playlistmembership_set.filter(video_id=video_id).delete()
+            self.set_orders([])
 
     def url_ranked(self):
         """Return a url with the first 50 videos in the playlist"""
-        ids = [entry.video.id for entry in self.get_videos()[:50]]
+        ids = self.video_ids()[:50]
         return "https://www.youtube.com/watch_videos?video_ids=" + ",".join(ids)
 
     def url_shuffled(self):
-        """Return a url with the first 50 videos in the playlist, shuffled"""
-        ids = [entry.video.id for entry in self.get_videos()]
-        random.shuffle(ids)
-        return "https://www.youtube.com/watch_videos?video_ids=" + ",".join(ids[:50])
-
-    def size(self):
-        return self.videos.count()
-
-    def sample_size(self):
-        return min(4, self.size())
-
-    def sample_range(self):
-        return range(self.sample_size())
-    
-    def sample(self):
-        return random.sample(
-            list(self.playlistmembership_set.all()),
-            self.sample_size(),
-        )
+        """Return a url with 50 random videos from the playlist"""
+        ids = self.video_ids()
+        ids = random.sample(ids, min(50, len(ids)))
+        return "https://www.youtube.com/watch_videos?video_ids=" + ",".join(ids)
 
 
 class PlaylistMembership(models.Model):
@@ -203,6 +321,11 @@ class PlaylistMembership(models.Model):
     addition = models.DateTimeField(auto_now_add=True, auto_now=False)
     order = models.IntegerField(default=-1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["playlist", "order"], name="membership_playlist_order"),
+        ]
+
     def __str__(self):
         return "PlaylistMembership<'%s' to '%s' (rk. %d)>" % (
             self.video,
@@ -212,10 +335,18 @@ class PlaylistMembership(models.Model):
 
     def save(self, *args, **kwargs):
         if self.order == -1:
-            self.order = len(self.playlist.videos.all())
+            self.order = self.playlist.next_order()
         models.Model.save(self, *args, **kwargs)
 
 
+@receiver(post_save, sender=PlaylistMembership)
+@receiver(post_delete, sender=PlaylistMembership)
+def invalidate_membership_playlist(instance, **kwargs):
+    """Drop the cached video ids of the playlist of a membership. Deletions
+    cascading from a video, a channel or a playlist are caught as well."""
+    invalidate_playlist_ids(instance.playlist_id)
+
+
 class TwitchUser(models.Model):
 
     """Represent a Twitch user"""
@@ -237,17 +368,6 @@ class TwitchUser(models.Model):
         return self.profile_image_url.replace("300x300", "50x50")
 
 
-class UpdateSchedule(models.Model):
-
-    """Store the update schedule as JSON format"""
-
-    text = models.TextField()
-
-    def to_json(self):
-        """Return a JSON object from stored text"""
-        return json.loads(self.text)
-
-
 class TwitchGame(models.Model):
 
     id = models.CharField(max_length=24, primary_key=True)
@@ -266,6 +386,11 @@ class YoutubeSubscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     channel = models.ForeignKey(YoutubeChannel, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "channel"], name="unique_youtube_subscription"),
+        ]
+
     def __str__(self):
         return "YouTube subscription (%s:%s)" % (self.user, self.channel.title)
 
@@ -275,6 +400,11 @@ class TwitchSubscription(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     channel = models.ForeignKey(TwitchUser, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "channel"], name="unique_twitch_subscription"),
+        ]
+
     def __str__(self):
         return "Twitch subscription (%s:%s)" % (self.user, self.channel.display_name)
     
@@ -286,4 +416,29 @@ class SubscriptionHistory(models.Model):
 
     def __str__(self):
         return "Subscription history (%s)" % self.user
-    
+
+
+class FeedEntry(models.Model):
+
+    """Represent a video shown in the home feed of a user. Entries are
+    materialized at ingestion time and when filters or subscriptions change,
+    so that the home view is a single indexed query."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    channel = models.ForeignKey(YoutubeChannel, on_delete=models.CASCADE)
+    video = models.ForeignKey(YoutubeVideo, on_delete=models.CASCADE)
+    publication = models.DateTimeField()
+    gathering = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "video"], name="unique_feed_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-publication", "-video"], name="feed_user_publication_video"),
+            models.Index(fields=["user", "-gathering", "-video"], name="feed_user_gathering_video"),
+            models.Index(fields=["user", "channel"], name="feed_user_channel"),
+        ]
+
+    def __str__(self):
+        return "Feed entry (%s:%s)" % (self.user, self.video_id)
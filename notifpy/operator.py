@@ -1,11 +1,25 @@
 """This module provides the Operator class"""
 
-import datetime
-import json
+import concurrent.futures
 import re
+import time
+import logging
+import threading
+import requests
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
-from .endpoint import YoutubeEndpoint, TwitchEndpoint
+from django.utils.text import slugify
+from .endpoint import YoutubeEndpoint, TwitchEndpoint, create_session
+from . import atom
+from . import feed
 from . import models
+from . import scheduler
 
 
 def select_thumbnail(snippet):
@@ -43,26 +57,71 @@ def extract_video_ids(string):
         yield extract_video_id(string)
 
 
+SOURCE_API = "api"
+SOURCE_RSS = "rss"
+SOURCES = (SOURCE_API, SOURCE_RSS)
+
+STREAMS_CACHE_KEY = "notifpy:streams"
+STREAMS_LOCK = threading.Lock()
+
+
 class Operator:
     """Operator that uses API endpoints to edit the database."""
 
     def __init__(self):
-        settings = models.Settings.load()
+        api_settings = models.Settings.load()
         self.youtube = None
         self.twitch = None
-        credentials_youtube = settings.get_youtube()
+        credentials_youtube = api_settings.get_youtube()
         if len(credentials_youtube) > 0:
             self.youtube = YoutubeEndpoint(credentials_youtube)
-        credentials_twitch = settings.get_twitch()
+        credentials_twitch = api_settings.get_twitch()
         if len(credentials_twitch) > 0:
             self.twitch = TwitchEndpoint(credentials_twitch)
-        if not models.UpdateSchedule.objects.all().exists():
-            schedule = models.UpdateSchedule.objects.create(text=json.dumps({
-                models.YoutubeChannel.PRIORITY_LOW: [3],
-                models.YoutubeChannel.PRIORITY_MEDIUM: [9, 19],
-                models.YoutubeChannel.PRIORITY_HIGH: [9, 12, 19],
-            }))
-            schedule.save()
+        self.feed_timeout = getattr(settings, "NOTIFPY_HTTP_TIMEOUT", 10)
+        self.feed_session = create_session(
+            getattr(settings, "NOTIFPY_HTTP_POOL_SIZE", 10),
+            getattr(settings, "NOTIFPY_HTTP_RETRIES", 3),
+            getattr(settings, "NOTIFPY_HTTP_BACKOFF", .5),
+        )
+
+    def fetch_twitch_users(self, ids=None, logins=None):
+        """Fetch Twitch users from the API, by batches of 100 ids or logins"""
+        items = list()
+        if self.twitch is None:
+            return items
+        batch_size = 100
+        for key, values in [("ids", ids), ("logins", logins)]:
+            values = list(values or list())
+            for i in range(0, len(values), batch_size):
+                response = self.twitch.users(**{key: values[i:i+batch_size]})
+                if response is not None:
+                    items += response["data"]
+        return items
+
+    def store_twitch_users(self, items):
+        """Insert or update Twitch users from API items, and return them"""
+        fields = ["login", "display_name", "profile_image_url", "offline_image_url"]
+        items = {item["id"]: item for item in items}
+        with transaction.atomic():
+            existing = models.TwitchUser.objects.in_bulk(list(items))
+            created = list()
+            updated = list()
+            for user_id, item in items.items():
+                if user_id not in existing:
+                    created.append(models.TwitchUser(
+                        id=user_id,
+                        **{field: item[field] for field in fields}
+                    ))
+                    continue
+                twitch_user = existing[user_id]
+                if any(getattr(twitch_user, field) != item[field] for field in fields):
+                    for field in fields:
+                        setattr(twitch_user, field, item[field])
+                    updated.append(twitch_user)
+            models.TwitchUser.objects.bulk_create(created, ignore_conflicts=True)
+            models.TwitchUser.objects.bulk_update(updated, fields)
+        return existing, created, updated
 
     def follow_users(self, query):
         """Follow a set of Twitch users"""
@@ -73,66 +132,63 @@ class Operator:
         }
         if self.twitch is None:
             return statistics
-        response = self.twitch.users(
-            logins=[s.strip() for s in query.strip().split("\n")]
-        )
-        if response is None:
-            return statistics
-        for twitch_user_item in response["data"]:
-            if models.TwitchUser.objects.filter(id=twitch_user_item["id"]).exists():
-                statistics["existing"] += 1
-                statistics["users"].append(models.TwitchUser.objects.get(id=twitch_user_item["id"]))
-                continue
-            twitch_user = models.TwitchUser.objects.create(
-                id=twitch_user_item["id"],
-                login=twitch_user_item["login"],
-                display_name=twitch_user_item["display_name"],
-                profile_image_url=twitch_user_item["profile_image_url"],
-                offline_image_url=twitch_user_item["offline_image_url"],
-            )
-            twitch_user.save()
-            statistics["users"].append(twitch_user)
-            statistics["created"] += 1
+        logins = [s.strip() for s in query.strip().split("\n")]
+        logins = list(dict.fromkeys(login for login in logins if login))
+        existing, created, _ = self.store_twitch_users(self.fetch_twitch_users(logins=logins))
+        statistics["existing"] = len(existing)
+        statistics["created"] = len(created)
+        statistics["users"] = list(existing.values()) + created
         return statistics
 
+    def refresh_twitch_users(self, users=None):
+        """Refresh the profiles of Twitch users, all of them by default.
+        Return the number of updated users."""
+        if self.twitch is None:
+            return 0
+        if users is None:
+            users = models.TwitchUser.objects.all()
+        user_ids = list(users.values_list("id", flat=True))
+        _, _, updated = self.store_twitch_users(self.fetch_twitch_users(ids=user_ids))
+        return len(updated)
+
     def update_user_thumbnail(self, user_login):
         """Fetch the thumbnail from the API"""
-        if not models.TwitchUser.objects.filter(login=user_login).exists():
-            return
-        twitch_user = models.TwitchUser.objects.get(login=user_login)
-        if self.twitch is None:
-            return
-        response = self.twitch.users(logins=[twitch_user.login])
-        if response is None:
-            return
-        twitch_user_item = response["data"][0]
-        twitch_user.profile_image_url = twitch_user_item["profile_image_url"]
-        twitch_user.save()
+        self.refresh_twitch_users(models.TwitchUser.objects.filter(login=user_login))
+
+    def get_twitch_games(self, game_ids):
+        """Return a dictionnary of Twitch games from database, fetching the
+        unknown ones from the API in batches"""
+        game_ids = set(game_ids) - {""}
+        games = models.TwitchGame.objects.in_bulk(list(game_ids))
+        missing = [game_id for game_id in game_ids if game_id not in games]
+        if len(missing) == 0 or self.twitch is None:
+            return games
+        batch_size = 100
+        fetched = list()
+        for i in range(0, len(missing), batch_size):
+            response = self.twitch.games(ids=missing[i:i+batch_size])
+            if response is None:
+                continue
+            for game_item in response["data"]:
+                fetched.append(models.TwitchGame(
+                    id=game_item["id"],
+                    name=game_item["name"],
+                    box_art_url=game_item["box_art_url"]
+                ))
+        models.TwitchGame.objects.bulk_create(fetched, ignore_conflicts=True)
+        games.update({game.id: game for game in fetched})
+        return games
 
     def get_twitch_game(self, game_id):
         """Return a Twitch game from database or fetch it if necessary"""
-        if game_id == "":
-            return None
-        if models.TwitchGame.objects.filter(id=game_id).exists():
-            return models.TwitchGame.objects.get(id=game_id)
-        if self.twitch is None:
-            return None
-        response = self.twitch.games(ids=[game_id])
-        if response is None or len(response["data"]) == 0:
-            return None
-        game_item = response["data"][0]
-        game = models.TwitchGame.objects.create(
-            id=game_item["id"],
-            name=game_item["name"],
-            box_art_url=game_item["box_art_url"]
-        )
-        return game
+        return self.get_twitch_games([game_id]).get(game_id)
 
     def get_streams(self, users):
         """Get currently live streams"""
         if len(users) == 0 or self.twitch is None:
             return []
-        logins = [user.login for user in users]
+        users = {user.id: user for user in users}
+        logins = [user.login for user in users.values()]
         batch_size = 99
         aggregated = list()
         for i in range(0, len(logins), batch_size):
@@ -141,21 +197,68 @@ class Operator:
             if response is None:
                 continue
             aggregated += response["data"]
+        games = self.get_twitch_games(stream["game_id"] for stream in aggregated)
         results = list()
         for stream in aggregated:
-            stream["user"] = models.TwitchUser.objects.get(
-                id=stream["user_id"])
+            if stream["user_id"] not in users:
+                continue
+            stream["user"] = users[stream["user_id"]]
             stream["thumbnail"] = stream["thumbnail_url"].format(
                 width=320,  # width=800,
                 height=180  # height=450
             )
-            stream["game"] = self.get_twitch_game(stream["game_id"])
+            stream["game"] = games.get(stream["game_id"])
             results.append(stream)
         results.sort(key=lambda x: -x["viewer_count"])
         return results
 
-    def subscribe_to_channels(self, main_query):
-        """Subscribe to a set of YouTube channels"""
+    def get_streams_snapshot(self):
+        """Return the live streams of every followed Twitch user, in a JSON
+        friendly format. The snapshot is shared by all users and cached for
+        NOTIFPY_STREAMS_TTL seconds."""
+        snapshot = cache.get(STREAMS_CACHE_KEY)
+        if snapshot is not None:
+            return snapshot
+        with STREAMS_LOCK:
+            snapshot = cache.get(STREAMS_CACHE_KEY)
+            if snapshot is not None:
+                return snapshot
+            users = models.TwitchUser.objects\
+                .filter(twitchsubscription__isnull=False)\
+                .distinct()
+            snapshot = list()
+            for stream in self.get_streams(list(users)):
+                snapshot.append({
+                    "user_id": stream["user_id"],
+                    "lnk": stream["user"].link(),
+                    "thumb": stream["user"].thumbnail(),
+                    "name": stream["user_name"],
+                    "game": "Uncategorized",
+                    "title": stream["title"],
+                    "screen": stream["thumbnail"],
+                    "started_at": stream["started_at"],
+                    "viewer_count": stream["viewer_count"],
+                })
+                if stream["game"] is not None:
+                    snapshot[-1]["game"] = stream["game"].name
+            cache.set(
+                STREAMS_CACHE_KEY,
+                snapshot,
+                getattr(settings, "NOTIFPY_STREAMS_TTL", 60)
+            )
+        return snapshot
+
+    def fetch_username(self, username):
+        """Look a YouTube channel up by its legacy username. This is safe to
+        call from a worker thread."""
+        try:
+            return self.youtube.channels_list(for_username=username)
+        finally:
+            db.connection.close()
+
+    def subscribe_to_channels(self, main_query, workers=8):
+        """Subscribe to a set of YouTube channels. Channel ids are resolved
+        by batches of 50, usernames are looked up concurrently."""
         queries = [s.strip() for s in main_query.strip().split("\n")]
         url_channel_pattern = re.compile(r"channel\/(.{24})")
         url_username_pattern = re.compile(r"user\/([a-zA-Z0-9-]+)")
@@ -167,144 +270,398 @@ class Operator:
         }
         if self.youtube is None:
             return statistics
+        channel_ids = list()
+        usernames = list()
         for query in queries:
-            channel_id = None
-            snippet = None
             if url_username_pattern.search(query) is not None:
-                username = url_username_pattern.search(query).group(1)
-                response = self.youtube.channels_list(for_username=username)
-                if response is None or response["pageInfo"]["totalResults"] == 0:
-                    continue
-                snippet = response["items"][0]
+                usernames.append(url_username_pattern.search(query).group(1))
             elif url_channel_pattern.search(query) is not None:
-                channel_id = url_channel_pattern.search(query).group(1)
-                response = self.youtube.channels_list(channel_id=channel_id)
-                if response is None or response["pageInfo"]["totalResults"] == 0:
-                    continue
-                snippet = response["items"][0]
-            if snippet is not None:
-                if models.YoutubeChannel.objects.filter(id=snippet["id"]).exists():
-                    statistics["existing"] += 1
-                    statistics["channels"].append(models.YoutubeChannel.objects.get(id=snippet["id"]))
-                    continue
-                thumbnail = ""
-                if "high" in snippet["snippet"]["thumbnails"]:
-                    thumbnail = snippet["snippet"]["thumbnails"]["high"]["url"]
-                elif "medium" in snippet["snippet"]["thumbnails"]:
-                    thumbnail = snippet["snippet"]["thumbnails"]["medium"]["url"]
-                else:
-                    thumbnail = snippet["snippet"]["thumbnails"]["default"]["url"]
-                channel = models.YoutubeChannel.objects.create(
-                    id=snippet["id"],
-                    title=snippet["snippet"]["title"],
-                    thumbnail=thumbnail,
-                    priority=models.YoutubeChannel.PRIORITY_MEDIUM,
-                    playlist_id=snippet["contentDetails"]["relatedPlaylists"]["uploads"],
-                )
-                channel.save()
-                statistics["created"] += 1
-                statistics["channels"].append(channel)
+                channel_ids.append(url_channel_pattern.search(query).group(1))
             else:
                 statistics["ignored"] += 1
+        channel_ids = list(dict.fromkeys(channel_ids))
+        usernames = list(dict.fromkeys(usernames))
+        items = list()
+        batch_size = 50
+        for i in range(0, len(channel_ids), batch_size):
+            response = self.youtube.channels_list(
+                channel_id=",".join(channel_ids[i:i+batch_size]))
+            if response is not None:
+                items += response.get("items", list())
+        if len(usernames) > 0:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(workers, len(usernames))) as executor:
+                for response in executor.map(self.fetch_username, usernames):
+                    if response is None or response["pageInfo"]["totalResults"] == 0:
+                        continue
+                    items.append(response["items"][0])
+        items = {item["id"]: item for item in items}
+        existing = models.YoutubeChannel.objects.in_bulk(list(items))
+        statistics["existing"] = len(existing)
+        new_channels = list()
+        for channel_id, item in items.items():
+            if channel_id in existing:
+                continue
+            thumbnails = item["snippet"]["thumbnails"]
+            if "high" in thumbnails:
+                thumbnail = thumbnails["high"]["url"]
+            elif "medium" in thumbnails:
+                thumbnail = thumbnails["medium"]["url"]
+            else:
+                thumbnail = thumbnails["default"]["url"]
+            new_channels.append(models.YoutubeChannel(
+                id=channel_id,
+                title=item["snippet"]["title"],
+                slug=slugify(item["snippet"]["title"]),
+                thumbnail=thumbnail,
+                priority=models.YoutubeChannel.PRIORITY_MEDIUM,
+                playlist_id=item["contentDetails"]["relatedPlaylists"]["uploads"],
+            ))
+        models.YoutubeChannel.objects.bulk_create(new_channels, ignore_conflicts=True)
+        created = models.YoutubeChannel.objects.in_bulk([channel.id for channel in new_channels])
+        statistics["created"] = len(created)
+        statistics["ignored"] += len(new_channels) - len(created)
+        statistics["channels"] = list(existing.values()) + list(created.values())
         return statistics
 
-    def update_channel(self, channel):
-        """Update videos of a YouTube channel"""
-        if self.youtube is None:
-            return
-        channel.last_update = timezone.now()
-        channel.save()
-        response = self.youtube.playlist_items_list(channel.playlist_id)
-        if response is None:
-            return
-        for snippet in response["items"]:
-            rsc_id = snippet["snippet"]["resourceId"]
-            if rsc_id["kind"] != "youtube#video"\
-                    or models.YoutubeVideo.objects.filter(id=rsc_id["videoId"]).exists()\
-                    or not channel.video_is_valid(snippet["snippet"]["title"]):
-                continue
-            video = models.YoutubeVideo.objects.create(
-                id=rsc_id["videoId"],
+    def fetch_channel(self, channel):
+        """Fetch the last uploads of a YouTube channel, without touching the
+        database. This is safe to call from a worker thread."""
+        try:
+            return self.youtube.playlist_items_list(
+                channel.playlist_id, etag=channel.playlist_etag)
+        finally:
+            db.connection.close()
+
+    def ingest_channel(self, channel, response):
+        """Store the videos from a playlist items response. Items are sorted
+        from the newest, so the page is read until an already known video.
+        A failed request is retried after scheduler.RETRY_INTERVAL."""
+        with transaction.atomic():
+            channel.last_update = timezone.now()
+            if response is None:
+                channel.next_update = scheduler.next_update(
+                    channel.id, scheduler.RETRY_INTERVAL, channel.last_update)
+                channel.save(update_fields=["last_update", "next_update"])
+                return
+            last_video_id = channel.last_video_id
+            videos = list()
+            for snippet in response["items"]:
+                rsc_id = snippet["snippet"]["resourceId"]
+                if rsc_id["kind"] != "youtube#video":
+                    continue
+                if rsc_id["videoId"] == last_video_id:
+                    break
+                if channel.last_video_id == last_video_id:
+                    channel.last_video_id = rsc_id["videoId"]
+                if not channel.video_is_valid(snippet["snippet"]["title"]):
+                    continue
+                videos.append(models.YoutubeVideo(
+                    id=rsc_id["videoId"],
+                    channel=channel,
+                    title=snippet["snippet"]["title"],
+                    publication=snippet["snippet"]["publishedAt"],
+                    thumbnail=select_thumbnail(snippet)
+                ))
+            channel.playlist_etag = response.get("etag", "")
+            channel.save(update_fields=[
+                "last_update", "next_update", "playlist_etag", "last_video_id"])
+            self.ingest_videos(channel, videos)
+
+    def fetch_channel_feed(self, channel):
+        """Fetch the last uploads of a YouTube channel from its public RSS
+        feed, which costs no API quota. The feed is parsed while it is
+        downloaded, and a conditional request is sent so that an unchanged
+        feed is not downloaded again. Return None if the feed could not be
+        read. This is safe to call from a worker thread."""
+        headers = dict()
+        if channel.feed_etag:
+            headers["If-None-Match"] = channel.feed_etag
+        if channel.feed_last_modified:
+            headers["If-Modified-Since"] = channel.feed_last_modified
+        try:
+            with self.feed_session.get(
+                    atom.FEED_URL,
+                    params={"channel_id": channel.id},
+                    headers=headers,
+                    timeout=self.feed_timeout,
+                    stream=True) as response:
+                if response.status_code == 304:
+                    entries = list()
+                elif response.status_code == 200:
+                    response.raw.decode_content = True
+                    entries = list(atom.iter_entries(response.raw))
+                else:
+                    logging.warning("Feed of %s returned status %d",
+                                    channel.id, response.status_code)
+                    return None
+                return {
+                    "etag": response.headers.get("ETag", channel.feed_etag),
+                    "last_modified": response.headers.get(
+                        "Last-Modified", channel.feed_last_modified),
+                    "entries": entries,
+                }
+        except (requests.RequestException, atom.ParseError) as error:
+            logging.warning("Feed of %s could not be read: %s", channel.id, error)
+            return None
+
+    def fetch_updates(self, channel, source=SOURCE_API):
+        """Fetch the last uploads of a channel from the given source. The
+        Data API is used as a fallback when the RSS feed fails. Return the
+        source that answered and its response. This is safe to call from a
+        worker thread."""
+        if source == SOURCE_RSS:
+            response = self.fetch_channel_feed(channel)
+            if response is not None or self.youtube is None:
+                return SOURCE_RSS, response
+        return SOURCE_API, self.fetch_channel(channel)
+
+    def ingest_channel_feed(self, channel, response):
+        """Store the videos from a RSS feed response. Entries are sorted
+        from the newest, so the feed is read until an already known video.
+        A failed request is retried after scheduler.RETRY_INTERVAL."""
+        with transaction.atomic():
+            channel.last_update = timezone.now()
+            if response is None:
+                channel.next_update = scheduler.next_update(
+                    channel.id, scheduler.RETRY_INTERVAL, channel.last_update)
+                channel.save(update_fields=["last_update", "next_update"])
+                return
+            entries = list()
+            for entry in response["entries"]:
+                if entry["video_id"] == channel.last_video_id:
+                    break
+                entries.append(entry)
+            if len(entries) > 0:
+                channel.last_video_id = entries[0]["video_id"]
+            channel.feed_etag = response["etag"][:255]
+            channel.feed_last_modified = response["last_modified"][:64]
+            channel.save(update_fields=[
+                "last_update", "next_update", "feed_etag", "feed_last_modified",
+                "last_video_id"])
+            self.ingest_entries(channel, entries)
+
+    def ingest_updates(self, channel, source, response):
+        """Store the response of fetch_updates"""
+        if source == SOURCE_RSS:
+            self.ingest_channel_feed(channel, response)
+        else:
+            self.ingest_channel(channel, response)
+
+    def ingest_entries(self, channel, entries):
+        """Store the videos from Atom entries, as parsed by atom.iter_entries.
+        Entries from other channels are ignored. Return the new videos."""
+        videos = [
+            models.YoutubeVideo(
+                id=entry["video_id"],
                 channel=channel,
-                title=snippet["snippet"]["title"],
-                publication=snippet["snippet"]["publishedAt"],
-                thumbnail=select_thumbnail(snippet)
+                title=entry["title"],
+                publication=entry["published"],
+                thumbnail=atom.thumbnail_url(entry["video_id"]),
             )
-            video.save()
-            for playlist in channel.playlist_set.all():
-                if models.PlaylistMembership.objects\
-                        .filter(playlist=playlist, video=video).exists():
+            for entry in entries
+            if entry["channel_id"] == channel.id
+            and entry["published"] is not None
+            and channel.video_is_valid(entry["title"])
+        ]
+        return self.ingest_videos(channel, videos)
+
+    def ingest_videos(self, channel, videos):
+        """Insert the videos that are not in the database yet, and append
+        them to the playlists following the channel. Videos inserted
+        concurrently by another process (eg. a WebSub notification during a
+        polling run) are left to it. Return the new videos."""
+        with transaction.atomic():
+            known = set(models.YoutubeVideo.objects
+                        .filter(id__in=[video.id for video in videos])
+                        .values_list("id", flat=True))
+            new_videos = list()
+            for video in videos:
+                if video.id in known:
                     continue
-                membership = models.PlaylistMembership.objects.create(
-                    playlist=playlist,
-                    video=video
-                )
-                membership.save()
+                known.add(video.id)
+                new_videos.append(video)
+            if len(new_videos) == 0:
+                return new_videos
+            models.YoutubeVideo.objects.bulk_create(new_videos, ignore_conflicts=True)
+            gatherings = dict(models.YoutubeVideo.objects
+                              .filter(id__in=[video.id for video in new_videos])
+                              .values_list("id", "gathering"))
+            new_videos = [
+                video
+                for video in new_videos
+                if gatherings.get(video.id) == video.gathering
+            ]
+            if len(new_videos) == 0:
+                return new_videos
+            memberships = list()
+            for playlist in channel.playlist_set.annotate(
+                    last_order=Max("playlistmembership__order")):
+                order = 0 if playlist.last_order is None else playlist.last_order + 1
+                for video in new_videos:
+                    memberships.append(models.PlaylistMembership(
+                        playlist=playlist,
+                        video=video,
+                        order=order,
+                    ))
+                    order += 1
+                playlist.invalidate_video_ids()
+            models.PlaylistMembership.objects.bulk_create(memberships)
+            feed.add_videos(channel, new_videos)
+        return new_videos
 
-    def update_channels(self, priorities=None, verbose=False):
-        """Update all channels from the database"""
+    def update_channel(self, channel, source=SOURCE_API):
+        """Update videos of a YouTube channel"""
+        if source == SOURCE_RSS:
+            response = self.fetch_channel_feed(channel)
+            if response is not None or self.youtube is None:
+                self.ingest_channel_feed(channel, response)
+                return
         if self.youtube is None:
             return
+        self.ingest_channel(channel, self.youtube.playlist_items_list(
+            channel.playlist_id, etag=channel.playlist_etag))
+
+    def update_channels(self, priorities=None, verbose=False, workers=1, source=SOURCE_API):
+        """Update channels from the database. By default, only the channels
+        that are due according to the scheduler are updated. With more than
+        one worker, API requests are sent concurrently while database writes
+        remain serialized in the calling thread. With the RSS source, no
+        quota is spent unless a feed fails, so channels may be polled more
+        often."""
+        if self.youtube is None and source == SOURCE_API:
+            return
+        now = timezone.now()
         if priorities is None:
-            priorities = list()
-            now = datetime.datetime.now().hour
-            schedule = models.UpdateSchedule.objects.get().to_json()
-            for priority, hours in schedule.items():
-                if now in hours:
-                    priorities.append(int(priority))
-        for priority in priorities:
+            channels = list(scheduler.due_channels(now))
             if verbose:
-                print("Updating priority %d" % priority)
-            for channel in models.YoutubeChannel.objects.filter(priority=priority):
+                print("Updating %d due channels" % len(channels))
+        else:
+            channels = list(models.YoutubeChannel.objects.filter(priority__in=priorities))
+            if verbose:
+                print("Updating priorities %s" % ", ".join(map(str, priorities)))
+        if source == SOURCE_RSS:
+            intervals = scheduler.plan(cost=0, min_interval=scheduler.FEED_MIN_INTERVAL)
+        else:
+            intervals = scheduler.plan()
+        for channel in channels:
+            channel.next_update = scheduler.next_update(
+                channel.id,
+                intervals.get(channel.id, scheduler.DEFAULT_INTERVAL),
+                now
+            )
+        if workers <= 1:
+            for channel in channels:
                 print("Updating channel '%s'" % channel)
-                self.update_channel(channel)
+                try:
+                    self.update_channel(channel, source)
+                except Exception:
+                    logging.exception("Could not update channel %s", channel.id)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.fetch_updates, channel, source): channel
+                for channel in channels
+            }
+            for future in concurrent.futures.as_completed(futures):
+                channel = futures[future]
+                print("Updating channel '%s'" % channel)
+                try:
+                    self.ingest_updates(channel, *future.result())
+                except Exception:
+                    logging.exception("Could not update channel %s", channel.id)
 
     def add_video_to_playlist(self, playlist, query):
-        """Add a video to a playlist"""
+        """Add videos to a playlist. Unknown videos and channels are fetched
+        by batches of 50."""
         if self.youtube is None:
             return
-        for line in query.strip().split("\n"):
-            for video_id in extract_video_ids(line.strip()):
-                if video_id is None:
+        video_ids = [
+            video_id
+            for line in query.strip().split("\n")
+            for video_id in extract_video_ids(line.strip())
+            if video_id is not None
+        ]
+        videos = models.YoutubeVideo.objects.in_bulk(list(set(video_ids)))
+        missing = [video_id for video_id in dict.fromkeys(video_ids) if video_id not in videos]
+        batch_size = 50
+        video_items = list()
+        for i in range(0, len(missing), batch_size):
+            response = self.youtube.videos_list(",".join(missing[i:i+batch_size]))
+            if response is not None:
+                video_items += response.get("items", list())
+        channel_ids = list({item["snippet"]["channelId"] for item in video_items})
+        channels = models.YoutubeChannel.objects.in_bulk(channel_ids)
+        missing = [channel_id for channel_id in channel_ids if channel_id not in channels]
+        new_channels = list()
+        for i in range(0, len(missing), batch_size):
+            response = self.youtube.channels_list(channel_id=",".join(missing[i:i+batch_size]))
+            if response is None:
+                continue
+            for channel_item in response.get("items", list()):
+                new_channels.append(models.YoutubeChannel(
+                    id=channel_item["id"],
+                    title=channel_item["snippet"]["title"],
+                    slug=slugify(channel_item["snippet"]["title"]),
+                    thumbnail=channel_item["snippet"]["thumbnails"]["medium"]["url"],
+                    priority=models.YoutubeChannel.PRIORITY_NONE,
+                ))
+        with transaction.atomic():
+            models.YoutubeChannel.objects.bulk_create(new_channels, ignore_conflicts=True)
+            channels = models.YoutubeChannel.objects.in_bulk(channel_ids)
+            new_videos = dict()
+            for video_item in video_items:
+                channel_id = video_item["snippet"]["channelId"]
+                if channel_id not in channels:
                     continue
-                if models.YoutubeVideo.objects.filter(id=video_id).exists():
-                    video = models.YoutubeVideo.objects.get(id=video_id)
-                else:
-                    response = self.youtube.videos_list(video_id)
-                    if response is None or response["pageInfo"]["totalResults"] == 0:
-                        continue
-                    video_item = response["items"][0]
-                    channel_id = video_item["snippet"]["channelId"]
-                    if models.YoutubeChannel.objects.filter(id=channel_id).exists():
-                        channel = models.YoutubeChannel.objects.get(id=channel_id)
-                    else:
-                        channel_item = self.youtube.channels_list(
-                            channel_id=channel_id)["items"][0]
-                        channel = models.YoutubeChannel.objects.create(
-                            id=channel_item["id"],
-                            title=channel_item["snippet"]["title"],
-                            thumbnail=channel_item["snippet"]["thumbnails"]["medium"]["url"],
-                            priority=models.YoutubeChannel.PRIORITY_NONE,
-                        )
-                        channel.save()
-                    video = models.YoutubeVideo.objects.create(
-                        id=video_item["id"],
-                        channel=channel,
-                        title=video_item["snippet"]["title"],
-                        publication=video_item["snippet"]["publishedAt"],
-                        thumbnail=select_thumbnail(video_item),
-                    )
-                    video.save()
-                playlist_membership = models.PlaylistMembership.objects.create(
+                new_videos.setdefault(channel_id, list()).append(models.YoutubeVideo(
+                    id=video_item["id"],
+                    channel=channels[channel_id],
+                    title=video_item["snippet"]["title"],
+                    publication=video_item["snippet"]["publishedAt"],
+                    thumbnail=select_thumbnail(video_item),
+                ))
+            for channel_id, channel_videos in new_videos.items():
+                models.YoutubeVideo.objects.bulk_create(channel_videos, ignore_conflicts=True)
+                feed.add_videos(channels[channel_id], channel_videos)
+                videos.update({video.id: video for video in channel_videos})
+            order = playlist.next_order()
+            memberships = list()
+            for video_id in video_ids:
+                if video_id not in videos:
+                    continue
+                memberships.append(models.PlaylistMembership(
                     playlist=playlist,
-                    video=video,
-                )
-                playlist_membership.save()
+                    video=videos[video_id],
+                    order=order,
+                ))
+                order += 1
+            models.PlaylistMembership.objects.bulk_create(memberships)
+            playlist.invalidate_video_ids()
+
+
+OPERATOR = None
+OPERATOR_BIRTH = 0
+OPERATOR_LOCK = threading.RLock()
+
+
+def get_operator():
+    """Return an operator shared by the whole process. It is rebuilt when the
+    API settings or tokens are saved, and after NOTIFPY_OPERATOR_TTL seconds
+    to pick up changes made by other processes."""
+    global OPERATOR, OPERATOR_BIRTH
+    ttl = getattr(settings, "NOTIFPY_OPERATOR_TTL", 300)
+    with OPERATOR_LOCK:
+        if OPERATOR is None or time.time() - OPERATOR_BIRTH > ttl:
+            OPERATOR = Operator()
+            OPERATOR_BIRTH = time.time()
+        return OPERATOR
 
 
-def clear_old_videos(older_than=2592000):
-    """Remove old videos from the database"""
-    now = timezone.now()
-    for video in models.YoutubeVideo.objects.filter(playlistmembership=None):
-        if (now - video.gathering).total_seconds() > older_than:
-            video.delete()
+@receiver(post_save, sender=models.Settings)
+@receiver(post_save, sender=models.Token)
+def invalidate_operator(**kwargs):
+    """Drop the shared operator, so that the next call rebuilds it"""
+    global OPERATOR
+    with OPERATOR_LOCK:
+        OPERATOR = None
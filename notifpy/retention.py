@@ -0,0 +1,56 @@
+"""This module removes old videos from the database"""
+
+import datetime
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from . import models
+
+
+def expired_videos(older_than, windows=None, now=None):
+    """Return the videos gathered before the end of their retention window.
+    Windows are given in seconds, per channel priority, with older_than as
+    the default. Videos belonging to a playlist are always kept."""
+    if now is None:
+        now = timezone.now()
+    if windows is None:
+        windows = dict()
+    condition = Q(gathering__lt=now - datetime.timedelta(seconds=older_than))\
+        & ~Q(channel__priority__in=list(windows))
+    for priority, seconds in windows.items():
+        condition |= Q(
+            channel__priority=priority,
+            gathering__lt=now - datetime.timedelta(seconds=seconds)
+        )
+    return models.YoutubeVideo.objects.filter(condition, playlistmembership=None)
+
+
+def count_old_videos(older_than, windows=None):
+    """Return the number of expired videos, per channel priority"""
+    return dict(
+        expired_videos(older_than, windows)
+        .values_list("channel__priority")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+
+
+def clear_old_videos(older_than=2592000, windows=None, chunk_size=1000, progress=None):
+    """Delete expired videos by chunks, each in its own transaction, so that
+    the database is never locked for long. Return the number of deleted
+    videos."""
+    now = timezone.now()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                expired_videos(older_than, windows, now)
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if len(ids) == 0:
+                break
+            models.YoutubeVideo.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if progress is not None:
+            progress(deleted)
+    return deleted
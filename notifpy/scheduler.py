@@ -0,0 +1,119 @@
+"""This module schedules YouTube channel updates from their upload cadence"""
+
+import zlib
+import datetime
+import statistics
+from django.db.models import F, Q
+from django.utils import timezone
+from . import models
+from . import websub
+
+
+DAILY_QUOTA = 10000
+QUOTA_SHARE = .8
+UPDATE_COST = 3
+HISTORY_DAYS = 90
+HISTORY_SIZE = 10
+DAY = datetime.timedelta(days=1)
+MIN_INTERVAL = datetime.timedelta(hours=1)
+FEED_MIN_INTERVAL = datetime.timedelta(minutes=15)
+MAX_INTERVAL = datetime.timedelta(days=7)
+DEFAULT_INTERVAL = datetime.timedelta(days=1)
+RETRY_INTERVAL = datetime.timedelta(minutes=15)
+WEBSUB_FACTOR = 8
+PRIORITY_FACTORS = {
+    models.YoutubeChannel.PRIORITY_LOW: 2.,
+    models.YoutubeChannel.PRIORITY_MEDIUM: 1.,
+    models.YoutubeChannel.PRIORITY_HIGH: .5,
+}
+
+
+def phase(channel_id):
+    """Return a stable pseudo random number in [0, 1) for a channel, used to
+    spread channels with similar intervals over the day"""
+    return (zlib.crc32(channel_id.encode("utf8")) % 1000) / 1000.
+
+
+def upload_interval(publications):
+    """Return the median duration between the last uploads of a channel, or
+    None if there is not enough history"""
+    publications = sorted(publications, reverse=True)[:HISTORY_SIZE]
+    if len(publications) < 2:
+        return None
+    return datetime.timedelta(seconds=statistics.median(
+        (newer - older).total_seconds()
+        for newer, older in zip(publications, publications[1:])
+    ))
+
+
+def base_interval(priority, publications, min_interval=MIN_INTERVAL):
+    """Return the update interval of a channel before budget scaling. A
+    channel is polled about twice per upload period."""
+    interval = upload_interval(publications)
+    if interval is None:
+        interval = DEFAULT_INTERVAL
+    else:
+        interval = interval / 2
+    interval = interval * PRIORITY_FACTORS.get(priority, 1.)
+    return min(MAX_INTERVAL, max(min_interval, interval))
+
+
+def scheduled_channels():
+    """Return the channels that are updated automatically"""
+    return models.YoutubeChannel.objects\
+        .exclude(priority=models.YoutubeChannel.PRIORITY_NONE)
+
+
+def plan(cost=UPDATE_COST, min_interval=MIN_INTERVAL):
+    """Return the update interval of every scheduled channel. Channels
+    pushed by WebSub are polled WEBSUB_FACTOR times less often, as a safety
+    net. Intervals are stretched if their daily cost would not fit within
+    the quota budget; updates from the RSS feeds have no cost."""
+    since = timezone.now() - HISTORY_DAYS * DAY
+    publications = dict()
+    for channel_id, publication in models.YoutubeVideo.objects\
+            .filter(channel__in=scheduled_channels(), publication__gte=since)\
+            .values_list("channel_id", "publication"):
+        publications.setdefault(channel_id, list()).append(publication)
+    intervals = {
+        channel_id: base_interval(priority, publications.get(channel_id, list()), min_interval)
+        for channel_id, priority in scheduled_channels().values_list("id", "priority")
+    }
+    for channel_id in websub.active_channel_ids() & intervals.keys():
+        intervals[channel_id] = min(MAX_INTERVAL, intervals[channel_id] * WEBSUB_FACTOR)
+    daily_cost = cost * sum(DAY / interval for interval in intervals.values())
+    budget = DAILY_QUOTA * QUOTA_SHARE
+    if daily_cost > budget:
+        scale = daily_cost / budget
+        for channel_id in intervals:
+            intervals[channel_id] = intervals[channel_id] * scale
+    return intervals
+
+
+def next_update(channel_id, interval, now=None):
+    """Return the next due time of a channel that is being updated"""
+    if now is None:
+        now = timezone.now()
+    return now + interval * (.9 + .2 * phase(channel_id))
+
+
+def due_channels(now=None):
+    """Return the scheduled channels that should be updated, late ones first"""
+    if now is None:
+        now = timezone.now()
+    return scheduled_channels()\
+        .filter(Q(next_update__isnull=True) | Q(next_update__lte=now))\
+        .order_by(F("next_update").asc(nulls_first=True))
+
+
+def summary():
+    """Return statistics about the schedule, for the settings page"""
+    intervals = plan()
+    daily_updates = sum(DAY / interval for interval in intervals.values())
+    return {
+        "channels": len(intervals),
+        "due": due_channels().count(),
+        "daily_updates": round(daily_updates),
+        "daily_cost": round(UPDATE_COST * daily_updates),
+        "budget": round(DAILY_QUOTA * QUOTA_SHARE),
+    }
@@ -1,3 +1,123 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from . import models
 
-# Create your tests here.
+
+class SubscriptionsQueryCountTest(TestCase):
+    """The subscriptions page runs the same number of queries whatever the
+    number of channels and Twitch users"""
+
+    QUERIES = 5
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser("admin", password="admin")
+        self.user = User.objects.create_user("user", password="user")
+        models.SubscriptionHistory.objects.create(user=self.superuser)
+        models.SubscriptionHistory.objects.create(user=self.user)
+
+    def populate(self, size):
+        """Create channels and Twitch users up to the given size, all known
+        by the regular user and half of them subscribed by both users"""
+        start = models.YoutubeChannel.objects.count()
+        channels = models.YoutubeChannel.objects.bulk_create([
+            models.YoutubeChannel(
+                id="UC%022d" % i,
+                title="Channel %d" % i,
+                slug="channel-%d" % i,
+                thumbnail="https://yt3.ggpht.com/%d=s800" % i,
+                playlist_id="UU%022d" % i,
+            )
+            for i in range(start, size)
+        ])
+        users = models.TwitchUser.objects.bulk_create([
+            models.TwitchUser(
+                id=str(i),
+                login="user%d" % i,
+                display_name="User %d" % i,
+                profile_image_url="https://localhost/%d.png" % i,
+                offline_image_url="https://localhost/%d.png" % i,
+            )
+            for i in range(start, size)
+        ])
+        self.user.subscriptionhistory.youtube.add(*channels)
+        self.user.subscriptionhistory.twitch.add(*users)
+        for user in (self.superuser, self.user):
+            models.YoutubeSubscription.objects.bulk_create([
+                models.YoutubeSubscription(user=user, channel=channel)
+                for channel in channels[::2]
+            ])
+            models.TwitchSubscription.objects.bulk_create([
+                models.TwitchSubscription(user=user, channel=twitch_user)
+                for twitch_user in users[::2]
+            ])
+
+    def assert_constant_queries(self, user):
+        """Render the page with 1 then 30 channels and Twitch users"""
+        self.client.force_login(user)
+        for size in (1, 30):
+            self.populate(size)
+            with self.assertNumQueries(self.QUERIES):
+                response = self.client.get(reverse("notifpy:subscriptions"))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context["channels"]), size)
+            self.assertEqual(len(response.context["users"]), size)
+
+    def test_superuser(self):
+        self.assert_constant_queries(self.superuser)
+
+    def test_user(self):
+        self.assert_constant_queries(self.user)
+
+
+class PlaylistTest(TestCase):
+    """Playlist orders and cached video ids follow membership changes"""
+
+    def setUp(self):
+        owner = User.objects.create_user("owner", password="owner")
+        channel = models.YoutubeChannel.objects.create(
+            id="UC%022d" % 0,
+            title="Channel",
+            thumbnail="https://localhost/c.jpg",
+            playlist_id="UU%022d" % 0,
+        )
+        self.videos = models.YoutubeVideo.objects.bulk_create([
+            models.YoutubeVideo(
+                id="%011d" % i,
+                channel=channel,
+                title="Video %d" % i,
+                publication=timezone.now(),
+                thumbnail="https://localhost/v.jpg",
+            )
+            for i in range(4)
+        ])
+        self.playlist = models.Playlist.objects.create(title="Playlist", owner=owner)
+
+    def add(self, *videos):
+        for video in videos:
+            models.PlaylistMembership.objects.create(
+                playlist=self.playlist,
+                video=video,
+                order=self.playlist.next_order(),
+            )
+
+    def memberships(self):
+        return list(self.playlist.get_videos().values_list("video_id", "order"))
+
+    def test_remove_duplicated_video(self):
+        first, second, third, fourth = self.videos
+        self.add(first, second, third, second, fourth)
+        self.playlist.remove_video(second.id)
+        self.assertEqual(self.memberships(), [(first.id, 0), (third.id, 1), (fourth.id, 2)])
+        self.playlist.swap_orders(1, 2)
+        self.assertEqual(self.memberships(), [(first.id, 0), (fourth.id, 1), (third.id, 2)])
+
+    def test_video_deletion_invalidates_ids(self):
+        first, second = self.videos[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(first, second)
+        self.assertEqual(self.playlist.video_ids(), [first.id, second.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.channel.youtubevideo_set.filter(id=first.id).delete()
+        self.assertEqual(self.playlist.video_ids(), [second.id])
@@ -14,6 +14,7 @@ urlpatterns = [
     path("channel/<slug>/edit", views.edit_channel, name="edit_channel"),
     path("channel/<slug>/delete", views.delete_channel, name="delete_channel"),
     path("channel/<slug>/update", views.update_channel, name="update_channel"),
+    path("websub/<channel_id>", views.websub_callback, name="websub"),
     path("update", views.update_channels, name="update"),
     path("create-filter", views.create_filter, name="create_filter"),
     path("delete-filter", views.delete_filter, name="delete_filter"),
@@ -31,7 +32,6 @@ urlpatterns = [
     path("twitch-user/<login>/delete", views.delete_twitch_user, name="delete_twitch_user"),
     path("twitch-user/<login>/update-profile-picture", views.update_profile_picture, name="update_profile_picture"),
     path("settings", views.settings, name="settings"),
-    path("edit-schedule", views.edit_schedule, name="edit_schedule"),
     path("clear", views.clear_old_videos, name="clear_old_videos"),
     path("twitch-api", views.twitch_streams_api, name="twitch_streams_api"),
     path("playlists", views.view_playlists, name="playlists"),
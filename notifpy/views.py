@@ -1,19 +1,36 @@
 """This module contains all views from the application"""
 
+import io
 import re
 import json
+import math
+import random
+import datetime
+import logging
+import itertools
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
-from django.core.paginator import Paginator
+from django.core.cache import cache
 from django.urls import reverse
 from django.http import HttpResponse
-from django.db.models.functions import Lower
+from django.db import transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q, Value
+from django.db.models.functions import Lower, Replace
 from django.http import Http404
+from django.views.decorators.csrf import csrf_exempt
 from django.core.exceptions import PermissionDenied
 from piweb.decorators import require_app_access, require_superuser
-from piweb.utils import pretty_paginator
+from . import atom
+from . import feed
 from . import operator
 from . import models
+from . import retention
+from . import scheduler
+from . import websub
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+SUBSCRIPTIONS_PAGE_SIZE = 200
 
 
 def abstract(request):
@@ -24,55 +41,92 @@ def abstract(request):
 # VIEWS FOR HOMEPAGE
 
 
+def encode_cursor(entry, order):
+    """Return the pagination cursor pointing at a feed entry"""
+    delta = getattr(entry, order) - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return "%d.%s" % (microseconds, entry.video_id)
+
+
+def decode_cursor(cursor):
+    """Return the date and the video id a pagination cursor points at, or
+    None if the cursor is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        microseconds, video_id = cursor.split(".", 1)
+        return EPOCH + datetime.timedelta(microseconds=int(microseconds)), video_id
+    except (ValueError, OverflowError):
+        return None
+
+
 @require_app_access("notifpy")
 def home(request):
-    """Main view to display last updates."""
+    """Main view to display last updates. Pages are selected with a cursor on
+    the (date, video) pair of their first or last entry, so that deep pages
+    are as fast as the first one."""
     page_size = 18
-    page = int(request.GET.get("page", 1))
     order = request.GET.get("order", "publication")
-    querysets = []
-    for subscription in models.YoutubeSubscription.objects.filter(user=request.user):
-        filters = models.Filter.objects.filter(channel=subscription.channel, user=request.user)
-        if filters:
-            regex = "(" + "|".join(map(lambda f: f.regex, filters)) + ")"
-            queryset = subscription.channel.youtubevideo_set.filter(title__iregex=regex)
-        else:
-            queryset = subscription.channel.youtubevideo_set.all()
-        querysets.append(queryset)
-    video_list = []
-    if len(querysets) > 0:
-        video_list = querysets[0].union(*querysets[1:]).order_by("-" + order)
-    paginator = Paginator(video_list, page_size)
-    videos = paginator.get_page(page)
+    if order not in ("publication", "gathering"):
+        order = "publication"
+    entries = models.FeedEntry.objects\
+        .filter(user=request.user)\
+        .select_related("video", "video__channel")
+    after = decode_cursor(request.GET.get("after"))
+    before = decode_cursor(request.GET.get("before"))
+    try:
+        page = int(request.GET.get("page", 1))
+    except ValueError:
+        page = 1
+    if after is None and before is None:
+        page = 1
+    if before:
+        value, video_id = before
+        entries = entries\
+            .filter(Q(**{order + "__gt": value}) | Q(**{order: value, "video_id__gt": video_id}))\
+            .order_by(order, "video_id")
+    elif after:
+        value, video_id = after
+        entries = entries\
+            .filter(Q(**{order + "__lt": value}) | Q(**{order: value, "video_id__lt": video_id}))\
+            .order_by("-" + order, "-video_id")
+    else:
+        entries = entries.order_by("-" + order, "-video_id")
+    entries = list(entries[:page_size + 1])
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+    if before:
+        entries.reverse()
+    has_previous = bool(after) or (bool(before) and has_more)
+    has_next = bool(before) or has_more
+    total = cache.get_or_set(
+        "notifpy:feed-count:%d" % request.user.id,
+        lambda: models.FeedEntry.objects.filter(user=request.user).count(),
+        600
+    )
     return render(request, "notifpy/home.html", {
-        "videos": videos,
-        "video_paginator": pretty_paginator(videos),
+        "videos": [entry.video for entry in entries],
+        "order": order,
+        "page": page,
+        "page_count": max(1, math.ceil(total / page_size)),
+        "previous_cursor": encode_cursor(entries[0], order) if has_previous and entries else None,
+        "next_cursor": encode_cursor(entries[-1], order) if has_next and entries else None,
     })
 
 
 @require_app_access("notifpy")
 def twitch_streams_api(request):
     """View that simply returns a JSON from Twitch endpoint"""
-    body = list()
-    twitch_users = [
-        subscription.channel
-        for subscription in models.TwitchSubscription.objects.filter(user=request.user)
+    followed = set(
+        models.TwitchSubscription.objects
+        .filter(user=request.user)
+        .values_list("channel_id", flat=True)
+    )
+    body = [
+        stream
+        for stream in operator.get_operator().get_streams_snapshot()
+        if stream["user_id"] in followed
     ]
-    streams = operator.Operator().get_streams(twitch_users)
-    if streams is not None:
-        for stream in streams:
-            body.append({
-                "lnk": stream["user"].link(),
-                "thumb": stream["user"].thumbnail(),
-                "name": stream["user_name"],
-                "game": "Uncategorized",
-                "title": stream["title"],
-                "screen": stream["thumbnail"],
-                "started_at": stream["started_at"],
-                "viewer_count": stream["viewer_count"],
-            })
-            if stream["game"] is not None:
-                body[-1]["game"] = stream["game"].name
     return HttpResponse(json.dumps(body), content_type="application/json")
 
 
@@ -114,6 +168,7 @@ def view_playlist(request, slug):
     playlist.owned = playlist.owner == request.user
     return render(request, "notifpy/playlist.html", {
         "playlist": playlist,
+        "entries": playlist.get_videos().select_related("video__channel"),
     })
 
 
@@ -133,7 +188,7 @@ def add_playlist(request, slug):
     """Add a video (or more) to a playlist"""
     playlist = get_playlist_from_slug(slug, request.user)
     if request.method == "POST":
-        operator.Operator().add_video_to_playlist(
+        operator.get_operator().add_video_to_playlist(
             playlist, request.POST.get("video", ""))
     return redirect("notifpy:playlist", slug=playlist.slug)
 
@@ -143,10 +198,7 @@ def remove_playlist(request, slug):
     """Remove a video from a playlist"""
     playlist = get_playlist_from_slug(slug, request.user)
     if request.method == "POST":
-        video = models.YoutubeVideo.objects.get(id=request.POST["id"])
-        playlist.videos.remove(video)
-        playlist.save()
-        playlist.shift_orders()
+        playlist.remove_video(request.POST["id"])
     return redirect("notifpy:playlist", slug=playlist.slug)
 
 
@@ -162,13 +214,10 @@ def delete_playlist(request, slug):
 def order_playlist(request, slug):
     playlist = get_playlist_from_slug(slug, request.user)
     if request.method == "POST":
-        ordering = dict()
-        for i, playlist_membership_id in enumerate(request.POST.get("ordering").split(";")):
-            ordering[int(playlist_membership_id)] = i
-        for playlist_membership in playlist.playlistmembership_set.all():
-            if playlist_membership.id in ordering:
-                playlist_membership.order = ordering[playlist_membership.id]
-                playlist_membership.save()
+        playlist.set_orders([
+            int(playlist_membership_id)
+            for playlist_membership_id in request.POST.get("ordering").split(";")
+        ])
     return redirect("notifpy:playlist", slug=playlist.slug)
 
 
@@ -176,18 +225,10 @@ def order_playlist(request, slug):
 def move_playlist(request, slug, order, direction):
     """Edit the video odering within a playlist"""
     playlist = get_playlist_from_slug(slug, request.user)
-    ref = models.PlaylistMembership.objects.get(
-        playlist=playlist, order=int(order))
     if direction == "up":
-        new = models.PlaylistMembership.objects.get(
-            playlist=playlist, order=int(order) - 1)
+        playlist.swap_orders(int(order), int(order) - 1)
     elif direction == "down":
-        new = models.PlaylistMembership.objects.get(
-            playlist=playlist, order=int(order) + 1)
-    ref.order = new.order
-    ref.save()
-    new.order = int(order)
-    new.save()
+        playlist.swap_orders(int(order), int(order) + 1)
     return redirect("notifpy:playlist", slug=playlist.slug)
 
 
@@ -203,10 +244,40 @@ def publish_playlist(request, slug, state):
     return redirect("notifpy:playlist", slug=playlist.slug)
 
 
+def sample_playlists(playlists, size=4):
+    """Attach a few random memberships to each playlist, with one query for
+    all of them. Orders are drawn at random between 0 and the last order, so
+    playlists are never loaded entirely; gaps in the ordering only make a
+    sample smaller."""
+    condition = Q(pk__in=[])
+    for playlist in playlists:
+        playlist.samples = list()
+        if playlist.last_order is None:
+            continue
+        orders = random.sample(
+            range(playlist.last_order + 1),
+            min(size, playlist.video_count, playlist.last_order + 1)
+        )
+        condition |= Q(playlist=playlist, order__in=orders)
+    by_id = {playlist.id: playlist for playlist in playlists}
+    for membership in models.PlaylistMembership.objects\
+            .filter(condition)\
+            .select_related("video"):
+        by_id[membership.playlist_id].samples.append(membership)
+    for playlist in playlists:
+        random.shuffle(playlist.samples)
+
+
 @require_app_access("notifpy")
 def view_playlists(request):
     """View playlists"""
-    playlists = models.Playlist.objects.filter(owner=request.user)
+    playlists = list(models.Playlist.objects
+                     .filter(owner=request.user)
+                     .annotate(
+                         video_count=Count("playlistmembership"),
+                         last_order=Max("playlistmembership__order"))
+                     .order_by("id"))
+    sample_playlists(playlists)
     return render(request, "notifpy/playlists.html", {
         "playlists": playlists,
     })
@@ -223,11 +294,27 @@ def view_channel(request, slug):
     channel = models.YoutubeChannel.objects.get(slug=slug)
     subscribed = models.YoutubeSubscription.objects.filter(channel=channel, user=request.user).exists()
     filters = models.Filter.objects.filter(channel=channel, user=request.user)
-    if filters:
-        regex = "(" + "|".join(map(lambda f: f.regex, filters)) + ")"
-        videos = channel.youtubevideo_set.filter(title__iregex=regex).order_by("-publication")[:15]
+    if subscribed:
+        videos = [
+            entry.video
+            for entry in models.FeedEntry.objects
+            .filter(user=request.user, channel=channel)
+            .select_related("video", "video__channel")
+            .order_by("-publication")[:15]
+        ]
     else:
-        videos = channel.youtubevideo_set.order_by("-publication")[:15]
+        pattern = feed.get_pattern(request.user.id, channel.id)
+        videos = list(itertools.islice(
+            (
+                video
+                for video in channel.youtubevideo_set
+                .select_related("channel")
+                .order_by("-publication")
+                .iterator()
+                if feed.title_matches(pattern, video.title)
+            ),
+            15
+        ))
     return render(request, "notifpy/channel.html", {
         "channel": channel,
         "videos": videos,
@@ -266,22 +353,58 @@ def update_channel(_, slug):
     if not models.YoutubeChannel.objects.filter(slug=slug).exists():
         return redirect("notifpy:home")
     channel = models.YoutubeChannel.objects.get(slug=slug)
-    operator.Operator().update_channel(channel)
+    operator.get_operator().update_channel(channel)
     return redirect("notifpy:channel", slug=channel.slug)
 
 
+@csrf_exempt
+def websub_callback(request, channel_id):
+    """Answer the verification requests of the WebSub hub, and ingest the
+    videos it notifies"""
+    if request.method == "GET":
+        challenge = websub.verify_intent(channel_id, request.GET)
+        if challenge is None:
+            raise Http404("No pending WebSub request for this channel.")
+        return HttpResponse(challenge, content_type="text/plain")
+    if request.method != "POST":
+        return HttpResponse(status=405)
+    lease = models.WebSubLease.objects\
+        .select_related("channel")\
+        .filter(channel_id=channel_id)\
+        .first()
+    if lease is None:
+        raise Http404("No WebSub lease for this channel.")
+    if not websub.verify_signature(lease.secret, request.body, request.headers.get("X-Hub-Signature")):
+        logging.warning("Ignoring WebSub notification with invalid signature for %s", channel_id)
+        return HttpResponse(status=202)
+    try:
+        entries = list(atom.iter_entries(io.BytesIO(request.body)))
+    except atom.ParseError as error:
+        logging.error("Invalid WebSub notification for %s: %s", channel_id, error)
+        return HttpResponse(status=400)
+    operator.get_operator().ingest_entries(lease.channel, entries)
+    return HttpResponse(status=204)
+
+
 @require_app_access("notifpy")
 def create_filter(request):
     """Append a filter to a channel"""
     if request.method == "POST":
         channel = models.YoutubeChannel.objects.get(id=request.POST["channel"])
         for regex in request.POST["regexes"].split("\n"):
+            regex = re.sub("\r", "", regex)
+            try:
+                re.compile(regex)
+            except re.error:
+                logging.warning("Rejecting invalid filter regex %s", regex)
+                continue
             filters = models.Filter.objects.create(
                 user=request.user,
                 channel=channel,
-                regex=re.sub("\r", "", regex)
+                regex=regex
             )
             filters.save()
+        feed.rebuild_channel(request.user, channel)
         return redirect("notifpy:channel", slug=channel.slug)
     return redirect("notifpy:home")
 
@@ -293,9 +416,10 @@ def delete_filter(request):
         filters = models.Filter.objects.get(id=request.POST["id"])
         if filters.user != request.user and not request.user.is_superuser:
             raise PermissionDenied
-        slug = filters.channel.slug
+        channel = filters.channel
         filters.delete()
-        return redirect("notifpy:channel", slug=slug)
+        feed.rebuild_channel(filters.user, channel)
+        return redirect("notifpy:channel", slug=channel.slug)
     return redirect("notifpy:home")
 
 
@@ -327,77 +451,116 @@ def delete_twitch_user(_, login):
 @require_app_access("notifpy")
 def update_profile_picture(request, login):
     """Force update the profile picture of a given Twitch user"""
-    operator.Operator().update_user_thumbnail(login)
+    operator.get_operator().update_user_thumbnail(login)
     return redirect("notifpy:view_twitch_user", login=login)
 
 
 # VIEWS FOR SUBSCRIPTIONS
 
 
+def page_slice(queryset, page, size):
+    """Return the objects of a page of a queryset, and whether there is a
+    next page, without counting the whole queryset"""
+    objects = list(queryset[(page - 1) * size:page * size + 1])
+    return objects[:size], len(objects) > size
+
+
 @require_app_access("notifpy")
 def subscriptions(request):
     """View to a user current subscriptions"""
     history, _ = models.SubscriptionHistory.objects.get_or_create(user=request.user)
-    youtube_subscriptions = dict()
-    for subscription in models.YoutubeSubscription.objects.filter(user=request.user):
-        youtube_subscriptions[subscription.channel.id] = True
-    channels = history.youtube.order_by("title")
+    query = request.GET.get("q", "").strip()
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+    except ValueError:
+        page = 1
     if request.user.is_superuser:
-        channels = models.YoutubeChannel.objects.order_by("title")
-    for channel in channels:
-        channel.subscribed = youtube_subscriptions.get(channel.id, False)
-        channel.thumbnail_link = channel.thumbnail.replace("=s800", "=s32")
-    twitch_subscriptions = dict()
-    for subscription in models.TwitchSubscription.objects.filter(user=request.user):
-        twitch_subscriptions[subscription.channel.id] = True
-    users = history.twitch.order_by("login")
+        channels = models.YoutubeChannel.objects.all()
+        users = models.TwitchUser.objects.all()
+    else:
+        channels = history.youtube.all()
+        users = history.twitch.all()
+    if query:
+        channels = channels.filter(title__icontains=query)
+        users = users.filter(Q(login__icontains=query) | Q(display_name__icontains=query))
+    channels = channels\
+        .only("id", "title", "slug", "thumbnail")\
+        .annotate(
+            subscribed=Exists(models.YoutubeSubscription.objects.filter(
+                user=request.user, channel=OuterRef("pk"))),
+            thumbnail_link=Replace("thumbnail", Value("=s800"), Value("=s32")))\
+        .order_by("title")
+    users = users\
+        .annotate(subscribed=Exists(models.TwitchSubscription.objects.filter(
+            user=request.user, channel=OuterRef("pk"))))\
+        .order_by("login")
+    has_next = False
     if request.user.is_superuser:
-        users = models.TwitchUser.objects.order_by("login")
-    for user in users:
-        user.subscribed = twitch_subscriptions.get(user.id, False)    
+        channels, more_channels = page_slice(channels, page, SUBSCRIPTIONS_PAGE_SIZE)
+        users, more_users = page_slice(users, page, SUBSCRIPTIONS_PAGE_SIZE)
+        has_next = more_channels or more_users
     return render(request, "notifpy/subscriptions.html", {
         "history": history,
         "channels": channels,
         "users": users,
+        "paginated": request.user.is_superuser,
+        "query": query,
+        "page": page,
+        "has_next": has_next,
     })
 
 
+def add_youtube_subscriptions(user, channel_ids):
+    """Subscribe a user to several YouTube channels, and add their videos
+    to the user's feed"""
+    subscribed = set(models.YoutubeSubscription.objects
+                     .filter(user=user, channel_id__in=channel_ids)
+                     .values_list("channel_id", flat=True))
+    new_channel_ids = [
+        channel_id
+        for channel_id in channel_ids
+        if channel_id not in subscribed
+    ]
+    models.YoutubeSubscription.objects.bulk_create([
+        models.YoutubeSubscription(user=user, channel_id=channel_id)
+        for channel_id in new_channel_ids
+    ], ignore_conflicts=True)
+    feed.add_channels(user, new_channel_ids)
+
+
 @require_app_access("notifpy")
 def subscribe(request):
     """View to subscribe the logged in user to a channel"""
     if request.method == "POST":
-        channels = set()
-        users = set()
+        channel_ids = set()
+        user_ids = set()
         for key in request.POST:
             if key.startswith("youtube-"):
-                channel_id = key[8:]
-                if models.YoutubeChannel.objects.filter(id=channel_id).exists():
-                    channels.add(models.YoutubeChannel.objects.get(id=channel_id))
+                channel_ids.add(key[8:])
             elif key.startswith("twitch-"):
-                user_id = key[7:]
-                if models.TwitchUser.objects.filter(id=user_id).exists():
-                    users.add(models.TwitchUser.objects.get(id=user_id))
+                user_ids.add(key[7:])
         action = request.POST.get("action")
-        if action == "Subscribe":
-            for channel in channels:
-                if not models.YoutubeSubscription.objects.filter(channel=channel, user=request.user).exists():
-                    models.YoutubeSubscription.objects.create(channel=channel, user=request.user)
-            for user in users:
-                if not models.TwitchSubscription.objects.filter(channel=user, user=request.user).exists():
-                    models.TwitchSubscription.objects.create(channel=user, user=request.user)
-        elif action == "Unsubscribe" or action == "Remove from history":
-            for channel in channels:
-                for entry in models.YoutubeSubscription.objects.filter(channel=channel, user=request.user):
-                    entry.delete()
-            for user in users:
-                for entry in models.TwitchSubscription.objects.filter(channel=user, user=request.user):
-                    entry.delete()
-            history = getattr(request.user, "subscriptionhistory", None)
-            if action == "Remove from history" and history is not None:
-                for channel in channels:
-                    history.youtube.remove(channel)
-                for user in users:
-                    history.twitch.remove(user)
+        with transaction.atomic():
+            channel_ids = list(models.YoutubeChannel.objects.only("id").in_bulk(channel_ids))
+            user_ids = list(models.TwitchUser.objects.only("id").in_bulk(user_ids))
+            if action == "Subscribe":
+                add_youtube_subscriptions(request.user, channel_ids)
+                models.TwitchSubscription.objects.bulk_create([
+                    models.TwitchSubscription(user=request.user, channel_id=user_id)
+                    for user_id in user_ids
+                ], ignore_conflicts=True)
+            elif action == "Unsubscribe" or action == "Remove from history":
+                models.YoutubeSubscription.objects\
+                    .filter(user=request.user, channel_id__in=channel_ids)\
+                    .delete()
+                feed.remove_channels(request.user, channel_ids)
+                models.TwitchSubscription.objects\
+                    .filter(user=request.user, channel_id__in=user_ids)\
+                    .delete()
+                history = getattr(request.user, "subscriptionhistory", None)
+                if action == "Remove from history" and history is not None:
+                    history.youtube.remove(*channel_ids)
+                    history.twitch.remove(*user_ids)
     return redirect("notifpy:subscriptions")
 
 
@@ -405,12 +568,14 @@ def subscribe(request):
 def create_channel(request):
     """Subscribe to a YouTube channel"""
     if request.method == "POST" and "query" in request.POST:
-        result = operator.Operator().subscribe_to_channels(request.POST["query"])
+        result = operator.get_operator().subscribe_to_channels(request.POST["query"])
         history, _ = models.SubscriptionHistory.objects.get_or_create(user=request.user)
-        for channel in result["channels"]:
-            history.youtube.add(channel)
-            if not models.YoutubeSubscription.objects.filter(channel=channel, user=request.user).exists():
-                models.YoutubeSubscription.objects.create(channel=channel, user=request.user)
+        with transaction.atomic():
+            history.youtube.add(*result["channels"])
+            add_youtube_subscriptions(
+                request.user,
+                [channel.id for channel in result["channels"]]
+            )
     return redirect("notifpy:subscriptions")
 
 
@@ -418,12 +583,14 @@ def create_channel(request):
 def create_twitch_user(request):
     """Follow a Twitch user"""
     if request.method == "POST" and "query" in request.POST:
-        result = operator.Operator().follow_users(request.POST["query"])
+        result = operator.get_operator().follow_users(request.POST["query"])
         history, _ = models.SubscriptionHistory.objects.get_or_create(user=request.user)
-        for user in result["users"]:
-            history.twitch.add(user)
-            if not models.TwitchSubscription.objects.filter(channel=user, user=request.user).exists():
-                models.TwitchSubscription.objects.create(channel=user, user=request.user)
+        with transaction.atomic():
+            history.twitch.add(*result["users"])
+            models.TwitchSubscription.objects.bulk_create([
+                models.TwitchSubscription(channel=user, user=request.user)
+                for user in result["users"]
+            ], ignore_conflicts=True)
     return redirect("notifpy:subscriptions")
 
 
@@ -433,12 +600,6 @@ def create_twitch_user(request):
 @require_superuser
 def settings(request):
     """View to show general information and forms"""
-    schedule = models.UpdateSchedule.objects.get().to_json()
-    current_schedule = {
-        "low": " ".join(map(str, schedule["0"])),
-        "medium": " ".join(map(str, schedule["1"])),
-        "high": " ".join(map(str, schedule["2"]))
-    }
     channels = models.YoutubeChannel.objects\
         .exclude(priority=models.YoutubeChannel.PRIORITY_NONE)\
         .order_by("slug")
@@ -447,8 +608,8 @@ def settings(request):
         .extra(select={'lower_name': 'lower(display_name)'})\
         .order_by("lower_name")
     return render(request, "notifpy/settings.html", {
-        "current_schedule": current_schedule,
-        "operator": operator.Operator(),
+        "schedule": scheduler.summary(),
+        "operator": operator.get_operator(),
         "channels": channels,
         "users": users,
     })
@@ -457,7 +618,7 @@ def settings(request):
 @require_superuser
 def oauth_redirect(request, source):
     """Redirection handling during OAuth flow"""
-    opr = operator.Operator()
+    opr = operator.get_operator()
     if source == "youtube" and opr.youtube is not None:
         opr.youtube.oauth_flow.handle_redirect(request)
     elif source == "twitch" and opr.twitch is not None:
@@ -468,7 +629,7 @@ def oauth_redirect(request, source):
 @require_superuser
 def refresh_token(_, source):
     """Request an endpoint token to be refreshed"""
-    opr = operator.Operator()
+    opr = operator.get_operator()
     if source == "youtube" and opr.youtube is not None:
         opr.youtube.oauth_flow.refresh()
     elif source == "twitch" and opr.twitch is not None:
@@ -479,7 +640,7 @@ def refresh_token(_, source):
 @require_superuser
 def revoke_token(_, source):
     """Request an endpoint token to be revoked"""
-    opr = operator.Operator()
+    opr = operator.get_operator()
     if source == "youtube" and opr.youtube is not None:
         opr.youtube.oauth_flow.revoke()
     elif source == "twitch" and opr.twitch is not None:
@@ -491,24 +652,7 @@ def revoke_token(_, source):
 def clear_old_videos(request):
     """Remove old videos from database"""
     if request.method == "POST":
-        operator.clear_old_videos(older_than=int(request.POST["older"]))
-    return redirect("notifpy:settings")
-
-
-@require_superuser
-def edit_schedule(request):
-    """Edit automatic updates schedule"""
-    if request.method == "POST":
-        schedule = models.UpdateSchedule.objects.get()
-
-        def fun(query):
-            return [int(x.strip()) for x in query.split(" ") if x.strip() != ""]
-        schedule.text = json.dumps({
-            models.YoutubeChannel.PRIORITY_LOW: fun(request.POST["low"]),
-            models.YoutubeChannel.PRIORITY_MEDIUM: fun(request.POST["medium"]),
-            models.YoutubeChannel.PRIORITY_HIGH: fun(request.POST["high"]),
-        })
-        schedule.save()
+        retention.clear_old_videos(older_than=int(request.POST["older"]))
     return redirect("notifpy:settings")
 
 
@@ -516,6 +660,6 @@ def edit_schedule(request):
 def update_channels(request):
     """Update all YouTube channel videos"""
     if request.method == "POST":
-        operator.Operator().update_channels(
+        operator.get_operator().update_channels(
             list(map(int, request.POST["priority"])))
     return redirect("notifpy:home")
\ No newline at end of file
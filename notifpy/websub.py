@@ -0,0 +1,152 @@
+"""This module subscribes to YouTube uploads through WebSub (PubSubHubbub).
+The hub notifies the callback view of every new upload, so that polling
+only remains as a safety net."""
+
+import hmac
+import hashlib
+import logging
+import secrets
+import datetime
+import requests
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from . import models
+
+
+TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml?channel_id=%s"
+SIGNATURE_METHODS = ("sha1", "sha256", "sha384", "sha512")
+VERIFY_WINDOW = datetime.timedelta(hours=1)
+MAX_LEASE_FACTOR = 2
+
+
+def lease_duration():
+    """Return the lease duration requested to the hub, in seconds"""
+    return getattr(settings, "NOTIFPY_WEBSUB_LEASE_SECONDS", 432000)
+
+
+def is_enabled():
+    """Check if a public callback base URL is configured"""
+    return bool(getattr(settings, "NOTIFPY_WEBSUB_CALLBACK_BASE", ""))
+
+
+def topic_url(channel_id):
+    """Return the WebSub topic of the uploads of a channel"""
+    return TOPIC_URL % channel_id
+
+
+def callback_url(channel_id):
+    """Return the public URL the hub should call for a channel"""
+    return settings.NOTIFPY_WEBSUB_CALLBACK_BASE.rstrip("/")\
+        + reverse("notifpy:websub", kwargs={"channel_id": channel_id})
+
+
+def request_lease(channel, mode=models.WebSubLease.MODE_SUBSCRIBE, session=None):
+    """Ask the hub to subscribe to (or unsubscribe from) the uploads of a
+    channel. The hub confirms asynchronously by calling the callback view.
+    Return True if the hub accepted the request."""
+    lease, _ = models.WebSubLease.objects.get_or_create(
+        channel=channel,
+        defaults={"secret": secrets.token_hex(32)}
+    )
+    lease.mode = mode
+    lease.pending = True
+    lease.save()
+    try:
+        response = (session or requests).post(
+            getattr(settings, "NOTIFPY_WEBSUB_HUB", "https://pubsubhubbub.appspot.com/subscribe"),
+            data={
+                "hub.callback": callback_url(channel.id),
+                "hub.topic": topic_url(channel.id),
+                "hub.verify": "async",
+                "hub.mode": mode,
+                "hub.secret": lease.secret,
+                "hub.lease_seconds": lease_duration(),
+            },
+            timeout=getattr(settings, "NOTIFPY_HTTP_TIMEOUT", 10),
+        )
+    except requests.RequestException as error:
+        logging.error("WebSub %s request for %s failed: %s", mode, channel.id, error)
+        return False
+    if response.status_code not in (202, 204):
+        logging.error(
+            "WebSub hub refused %s request for %s (error %d): %s",
+            mode,
+            channel.id,
+            response.status_code,
+            response.text,
+        )
+        return False
+    return True
+
+
+def verify_intent(channel_id, params):
+    """Check a verification request from the hub against the last request
+    made for the channel. Only one verification is accepted per request,
+    within VERIFY_WINDOW, and the granted lease is capped to
+    MAX_LEASE_FACTOR times the requested one. Return the challenge to echo,
+    or None to refuse."""
+    mode = params.get("hub.mode")
+    challenge = params.get("hub.challenge")
+    if challenge is None or params.get("hub.topic") != topic_url(channel_id):
+        return None
+    lease = models.WebSubLease.objects.filter(channel_id=channel_id).first()
+    if lease is None or lease.mode != mode or not lease.pending:
+        return None
+    now = timezone.now()
+    if now - lease.requested > VERIFY_WINDOW:
+        return None
+    if mode == models.WebSubLease.MODE_SUBSCRIBE:
+        try:
+            lease_seconds = int(params.get("hub.lease_seconds", ""))
+        except ValueError:
+            lease_seconds = lease_duration()
+        lease_seconds = min(max(0, lease_seconds), MAX_LEASE_FACTOR * lease_duration())
+        lease.pending = False
+        lease.expiration = now + datetime.timedelta(seconds=lease_seconds)
+        lease.save(update_fields=["pending", "expiration"])
+    else:
+        lease.delete()
+    return challenge
+
+
+def verify_signature(secret, body, header):
+    """Check the X-Hub-Signature header of a notification"""
+    if not header or "=" not in header:
+        return False
+    method, signature = header.split("=", 1)
+    if method not in SIGNATURE_METHODS:
+        return False
+    digest = hmac.new(secret.encode("utf8"), body, getattr(hashlib, method)).hexdigest()
+    return hmac.compare_digest(digest, signature)
+
+
+def channels_to_renew(margin, now=None):
+    """Return the scheduled channels without a lease, or whose lease expires
+    within the margin (in seconds)"""
+    if now is None:
+        now = timezone.now()
+    limit = now + datetime.timedelta(seconds=margin)
+    return models.YoutubeChannel.objects\
+        .exclude(priority=models.YoutubeChannel.PRIORITY_NONE)\
+        .exclude(
+            websublease__mode=models.WebSubLease.MODE_SUBSCRIBE,
+            websublease__expiration__gt=limit,
+        )
+
+
+def leases_to_cancel():
+    """Return the leases of channels that are not scheduled anymore"""
+    return models.WebSubLease.objects\
+        .filter(mode=models.WebSubLease.MODE_SUBSCRIBE)\
+        .filter(channel__priority=models.YoutubeChannel.PRIORITY_NONE)\
+        .select_related("channel")
+
+
+def active_channel_ids(now=None):
+    """Return the ids of the channels with an active lease"""
+    if now is None:
+        now = timezone.now()
+    return set(models.WebSubLease.objects
+               .filter(mode=models.WebSubLease.MODE_SUBSCRIBE, expiration__gt=now)
+               .values_list("channel_id", flat=True))